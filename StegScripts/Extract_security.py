@@ -4,7 +4,9 @@ from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.backends import default_backend
 from PIL import Image
 import numpy as np
+import lz4.block
 import lz4.frame
+import zlib
 
 # ----------- HARDCODED VALUES ----------- #
 # Ensure this matches the OUTPUT_PATH from the embed script (must be .png)
@@ -21,6 +23,68 @@ def decrypt_chacha20(salt, nonce, ciphertext, password):
     decryptor = cipher.decryptor()
     return decryptor.update(ciphertext)
 
+# ----------- PAYLOAD FORMAT ----------- #
+# Must match app/src/main/python/stego.py. Images made by the app are either
+# the legacy LZ4 frame ("message||END||", as Embed_Security.py writes) or
+# version 1: header byte (version << 4 | method), 2-byte CRC check, body.
+PAYLOAD_VERSION = 1
+METHOD_RAW = 0
+METHOD_LZ4 = 1
+METHOD_DEFLATE = 2
+LZ4_FRAME_MAGIC = b"\x04\x22\x4d\x18"
+LZ4_MAX_RATIO = 255
+
+CHAT_DICTIONARY = (
+    "http://https://www..com/ meeting tomorrow morning tonight weekend "
+    "birthday congratulations appreciate definitely probably actually "
+    "address location password remember something everything anything "
+    "because before after again already always never maybe sorry please "
+    "thank you thanks so much love you miss you take care good night "
+    "good morning see you soon talk later on my way be there in 10 minutes "
+    "let me know call me when you get this can you send me the "
+    "what time are we still on for did you see the where are you "
+    "I think I don't know I'm not sure I will I can't wait haha lol ok okay "
+    "yes no yeah sure cool great nice awesome hey hi hello how are you "
+    "what's up are you free do you want to I'll be there just "
+    "the and that this with have for you it is in to of a I "
+).encode("utf-8")
+# -------------------------------------- #
+
+def _read_varint(data, pos):
+    n = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return n, pos
+        shift += 7
+
+def decode_payload(payload):
+    if payload[:4] == LZ4_FRAME_MAGIC:
+        # Legacy format
+        return lz4.frame.decompress(payload).decode("utf-8").split("||END||")[0]
+
+    version, method = payload[0] >> 4, payload[0] & 0x0F
+    if version != PAYLOAD_VERSION:
+        raise ValueError(f"Unsupported payload version {version}")
+    check, body = payload[1:3], payload[3:]
+    if method == METHOD_RAW:
+        raw = body
+    elif method == METHOD_LZ4:
+        size, pos = _read_varint(body, 0)
+        if size > (len(body) - pos) * LZ4_MAX_RATIO:
+            raise ValueError("Invalid payload size")
+        raw = lz4.block.decompress(body[pos:], uncompressed_size=size)
+    elif method == METHOD_DEFLATE:
+        decompressor = zlib.decompressobj(-15, zdict=CHAT_DICTIONARY)
+        raw = decompressor.decompress(body) + decompressor.flush()
+    else:
+        raise ValueError(f"Unknown payload method {method}")
+    if (zlib.crc32(raw) & 0xFFFF).to_bytes(2, "big") != check:
+        raise ValueError("Payload check failed (wrong password?)")
+    return raw.decode("utf-8")
+
 def bits_to_message(bits, password=PASSWORD):
     marker = bits[:8]
     if marker != '01000101':  # 'E'
@@ -45,8 +109,7 @@ def bits_to_message(bits, password=PASSWORD):
         ciphertext = bytes(encrypted_bytes[32:])
 
         decrypted = decrypt_chacha20(salt, nonce, ciphertext, password)
-        decompressed = lz4.frame.decompress(decrypted)
-        return decompressed.decode('utf-8').split("||END||")[0]
+        return decode_payload(decrypted)
         
     except Exception as e:
         return f"[Extraction Failed] {e}"
@@ -86,6 +149,11 @@ def extract_pvd(image_path, password=PASSWORD):
         elif diff < 64:    n_bits = 4
         else:              n_bits = 5
 
+        # The last pair carries only the remaining bits (mirrors the embed side)
+        remaining = total_bits_to_read - bit_count
+        if n_bits > remaining:
+            n_bits = remaining
+
         d_prime = diff % (2 ** n_bits)
         extracted_bits.append(f'{d_prime:0{n_bits}b}')
         bit_count += n_bits
@@ -751,7 +751,7 @@ fun ChatScreenContent(
                             Spacer(modifier = Modifier.width(8.dp))
                             if (replyingTo.imageUri != null) {
                                 AsyncImage(
-                                    model = replyingTo.imageUri, 
+                                    model = replyingTo.displayUri, 
                                     contentDescription = null, 
                                     modifier = Modifier.size(36.dp).clip(RoundedCornerShape(4.dp)).background(Color.Gray),
                                     contentScale = ContentScale.Crop
@@ -1080,7 +1080,7 @@ fun MessageBubble(
                                  Spacer(modifier = Modifier.width(8.dp))
                                  if (replied.imageUri != null) {
                                     AsyncImage(
-                                        model = replied.imageUri, 
+                                        model = replied.displayUri, 
                                         contentDescription = null, 
                                         modifier = Modifier.size(36.dp).clip(RoundedCornerShape(4.dp)).background(MaterialTheme.colorScheme.surfaceVariant),
                                         contentScale = ContentScale.Crop
@@ -1094,7 +1094,7 @@ fun MessageBubble(
                  }
                 if (message.imageUri != null) {
                     Box(contentAlignment = Alignment.Center) {
-                        AsyncImage(model = message.imageUri, contentDescription = null, modifier = Modifier.fillMaxWidth().height(200.dp).clip(RoundedCornerShape(12.dp)), contentScale = ContentScale.Crop) // Removed clickable from here
+                        AsyncImage(model = message.displayUri, contentDescription = null, modifier = Modifier.fillMaxWidth().height(200.dp).clip(RoundedCornerShape(12.dp)), contentScale = ContentScale.Crop) // Removed clickable from here
                         if (message.status == 1) {
                              val context = LocalContext.current
                              var fileSize by remember(message.imageUri) { mutableStateOf(0L) }
@@ -36,6 +36,9 @@ interface MessageDao {
     @Query("UPDATE messages SET deliveryStatus = :status WHERE id = :id")
     suspend fun updateDeliveryStatus(id: String, status: Int)
 
+    @Query("UPDATE messages SET deliveryStatus = :status WHERE id IN (:ids)")
+    suspend fun updateDeliveryStatuses(ids: List<String>, status: Int)
+
     @Query("SELECT * FROM messages WHERE text LIKE '%' || :query || '%' ORDER BY timestamp DESC")
     fun searchMessages(query: String): Flow<List<MessageEntity>>
 
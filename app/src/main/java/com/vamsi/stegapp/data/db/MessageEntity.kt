@@ -9,6 +9,7 @@ data class MessageEntity(
     val chatId: String,
     val text: String?,
     val imageUri: String?, // Stored as String, convert to Uri when reading
+    val previewUri: String? = null, // Lossy preview of a remote stego image (shown until downloaded)
     val isFromMe: Boolean,
     val isStego: Boolean,
     val status: Int = 0,
@@ -7,10 +7,16 @@ data class Message(
     val chatId: String,
     val text: String? = null,
     val imageUri: Uri? = null,
+    val previewUri: Uri? = null, // Lossy preview for remote images; never holds the payload
     val isFromMe: Boolean,
     val isStego: Boolean = false,
     val status: Int = 0, // 0: Normal/Sent, 1: Sending/Uploading, 2: Remote/Pending Download, 3: Downloading, 4: Downloaded
     val deliveryStatus: Int = 0, // 0: Pending, 1: Sent, 2: Delivered, 3: Read
     val timestamp: Long = System.currentTimeMillis(),
     val replyToId: String? = null // Reply Support
-)
+) {
+    // What to render in lists: the small preview until the original has been
+    // downloaded (remote or downloading), so the UI never fetches the lossless file itself
+    val displayUri: Uri?
+        get() = if ((status == 2 || status == 3) && previewUri != null) previewUri else imageUri
+}
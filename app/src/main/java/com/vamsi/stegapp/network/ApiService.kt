@@ -5,6 +5,7 @@ import okhttp3.MultipartBody
 import retrofit2.Response
 import retrofit2.http.Body
 import retrofit2.http.GET
+import retrofit2.http.Header
 import retrofit2.http.Multipart
 import retrofit2.http.POST
 import retrofit2.http.Part
@@ -13,7 +14,16 @@ import retrofit2.http.Path
 data class UploadResponse(
     val status: String,
     val url: String,
-    val filename: String
+    val previewUrl: String? = null, // Small lossy preview; the lossless original is only fetched on open/extract
+    val filename: String,
+    val hash: String? = null,
+    val deduplicated: Boolean = false
+)
+
+data class UploadExistsResponse(
+    val exists: Boolean,
+    val url: String? = null,
+    val previewUrl: String? = null
 )
 
 data class UserRequest(
@@ -31,8 +41,19 @@ data class KeyFetchResponse(
     @SerializedName("public_key") val publicKey: String
 )
 
+data class UsernameListRequest(val usernames: List<String>)
+
 data class RegisterResponse(val status: String, val username: String)
-data class CheckUserResponse(val exists: Boolean)
+
+data class DiscoveredUser(
+    @SerializedName("public_key") val publicKey: String?,
+    val status: String
+)
+
+data class CheckUsersResponse(
+    val users: Map<String, DiscoveredUser>,
+    val missing: List<String>
+)
 
 interface ApiService {
     @Multipart
@@ -41,15 +62,22 @@ interface ApiService {
         @Part image: MultipartBody.Part
     ): Response<UploadResponse>
 
+    @GET("upload/exists/{hash}")
+    suspend fun uploadExists(@Path("hash") contentHash: String): Response<UploadExistsResponse>
+
     @POST("register")
     suspend fun register(@Body request: UserRequest): Response<RegisterResponse>
 
     @POST("keys/upload")
     suspend fun uploadKey(@Body request: KeyUploadRequest): Response<Unit>
 
+    // A null etag sends no If-None-Match; a matching one gets 304 with no body
     @GET("keys/fetch/{username}")
-    suspend fun fetchKey(@Path("username") username: String): Response<KeyFetchResponse>
+    suspend fun fetchKey(
+        @Path("username") username: String,
+        @Header("If-None-Match") etag: String? = null
+    ): Response<KeyFetchResponse>
 
-    @GET("check_user/{username}")
-    suspend fun checkUser(@Path("username") username: String): Response<CheckUserResponse>
+    @POST("check_users")
+    suspend fun checkUsers(@Body request: UsernameListRequest): Response<CheckUsersResponse>
 }
@@ -1,8 +1,10 @@
 package com.vamsi.stegapp.network
 
 import android.util.Log
+import io.socket.client.Ack
 import io.socket.client.IO
 import io.socket.client.Socket
+import org.json.JSONArray
 import org.json.JSONObject
 
 import kotlinx.coroutines.flow.MutableSharedFlow
@@ -25,6 +27,13 @@ object SocketClient {
 
     private val _messageStatusUpdates = MutableSharedFlow<JSONObject>(replay = 10, extraBufferCapacity = 10)
     val messageStatusUpdates = _messageStatusUpdates.asSharedFlow()
+
+    // One event per opened chat: { messageIds: [...], status: "read" }
+    private val _messageStatusBatches = MutableSharedFlow<JSONObject>(replay = 10, extraBufferCapacity = 10)
+    val messageStatusBatches = _messageStatusBatches.asSharedFlow()
+
+    // Server limit on messageIds per "messages_read" event
+    const val MAX_READ_BATCH = 500
     
     // Connection Status
     private val _isConnected = MutableStateFlow(false)
@@ -104,6 +113,15 @@ object SocketClient {
                 }
             }
 
+            // Listen for batched message status updates (e.g. a whole chat read at once)
+            socket?.on("message_status_batch") { args ->
+                if (args.isNotEmpty()) {
+                    val data = args[0] as JSONObject
+                    Log.d(TAG, "Message Status Batch: ${data.optJSONArray("messageIds")?.length()} ids")
+                    _messageStatusBatches.tryEmit(data)
+                }
+            }
+
             socket?.connect()
         } catch (e: Exception) {
             Log.e(TAG, "Socket Connection Error", e)
@@ -115,11 +133,12 @@ object SocketClient {
         socket?.off()
     }
 
-    fun emitMessage(id: String, text: String?, imageUrl: String?, sender: String, recipient: String, camouflageText: String? = null, timestamp: Long = System.currentTimeMillis(), replyToId: String? = null) {
+    fun emitMessage(id: String, text: String?, imageUrl: String?, sender: String, recipient: String, camouflageText: String? = null, timestamp: Long = System.currentTimeMillis(), replyToId: String? = null, previewUrl: String? = null) {
         val json = JSONObject().apply {
             put("id", id)
             put("text", text)
             put("imageUrl", imageUrl)
+            put("previewUrl", previewUrl)
             put("sender", sender)
             put("recipient", recipient)
             put("camouflageText", camouflageText)
@@ -156,12 +175,48 @@ object SocketClient {
         socket?.emit("message_read", json)
     }
 
-    fun emitSyncRequest(username: String, lastTimestamp: Long) {
+    /**
+     * Subscribe to presence updates for these contacts (replaces the previous list).
+     * onStatuses receives the server's ack: { username: "online"/"offline", ... },
+     * or { error: "rate_limited", retryAfter: seconds } when throttled.
+     */
+    fun subscribePresence(usernames: List<String>, onStatuses: (JSONObject) -> Unit) {
+        val json = JSONObject().apply {
+            put("usernames", JSONArray(usernames))
+        }
+        Log.d(TAG, "👥 SUBSCRIBING TO PRESENCE: ${usernames.size} contacts")
+        socket?.emit("subscribe_presence", arrayOf<Any>(json), Ack { args ->
+            val ack = args.firstOrNull() as? JSONObject
+            if (ack != null) onStatuses(ack)
+        })
+    }
+
+    fun emitMessagesRead(messageIds: List<String>, reader: String) {
+        messageIds.chunked(MAX_READ_BATCH).forEach { chunk ->
+            val json = JSONObject().apply {
+                put("messageIds", JSONArray(chunk))
+                put("reader", reader)
+            }
+            Log.d(TAG, "👁️ EMITTING BATCHED READ RECEIPT: ${chunk.size} messages")
+            socket?.emit("messages_read", json)
+        }
+    }
+
+    /**
+     * Ask for everything missed since lastSeq. Before the first seq is known
+     * (lastSeq = 0) the timestamp-based sync is used instead.
+     * onSynced receives the ack's lastSeq, the highest seq sent.
+     */
+    fun emitSyncRequest(username: String, lastSeq: Long, lastTimestamp: Long, onSynced: (Long) -> Unit = {}) {
         val json = JSONObject().apply {
             put("username", username)
-            put("lastTimestamp", lastTimestamp)
+            if (lastSeq > 0) put("lastSeq", lastSeq) else put("lastTimestamp", lastTimestamp)
         }
-        Log.d(TAG, "🔄 EMITTING SYNC REQUEST: timestamp=$lastTimestamp")
-        socket?.emit("sync_messages", json)
+        Log.d(TAG, "🔄 EMITTING SYNC REQUEST: seq=$lastSeq timestamp=$lastTimestamp")
+        socket?.emit("sync_messages", arrayOf<Any>(json), Ack { args ->
+            val ack = args.firstOrNull() as? JSONObject
+            val syncedSeq = ack?.optLong("lastSeq", 0L) ?: 0L
+            if (syncedSeq > 0) onSynced(syncedSeq)
+        })
     }
 }
@@ -9,6 +9,14 @@ import java.io.File
 
 class StegoRepository(private val context: Context) {
 
+    companion object {
+        // Rollout gate for the compact payload format (stego.py, version 1).
+        // Releases before it can only extract the legacy LZ4 frame: set this
+        // to true to keep writing that format until they are gone. Reading
+        // always accepts both.
+        const val LEGACY_PAYLOAD = false
+    }
+
     init {
         if (!Python.isStarted()) {
             Python.start(AndroidPlatform(context))
@@ -29,7 +37,7 @@ class StegoRepository(private val context: Context) {
                 }
                 val outputFile = File(outputDir, "stego_${System.currentTimeMillis()}.png")
 
-                val result = stegoModule.callAttr("embed_pvd", imagePath, message, outputFile.absolutePath, secretKey).toString()
+                val result = stegoModule.callAttr("embed_pvd", imagePath, message, outputFile.absolutePath, secretKey, LEGACY_PAYLOAD).toString()
                 
                 if (result.startsWith("SUCCESS:")) {
                     val finalPath = result.removePrefix("SUCCESS:")
@@ -22,6 +22,10 @@ import kotlinx.coroutines.CoroutineScope
 import kotlinx.coroutines.Dispatchers
 import kotlinx.coroutines.SupervisorJob
 import kotlinx.coroutines.cancel
+import kotlinx.coroutines.delay
+import kotlinx.coroutines.flow.combine
+import kotlinx.coroutines.flow.distinctUntilChanged
+import kotlinx.coroutines.flow.map
 import kotlinx.coroutines.launch
 import org.json.JSONObject
 import java.util.UUID
@@ -103,6 +107,19 @@ class SocketService : Service() {
                 }
             }
 
+            // Presence: subscribe to our contacts on every (re)connect and whenever
+            // the contact list changes. The ack seeds their current status.
+            serviceScope.launch {
+                val contactDao = AppDatabase.getDatabase(applicationContext).contactDao()
+                val contactNames = contactDao.getAllContacts()
+                    .map { contacts -> contacts.map { it.name }.toSet() }
+                    .distinctUntilChanged()
+                combine(SocketClient.isConnected, contactNames) { connected, names -> connected to names }
+                    .collect { (connected, names) ->
+                        if (connected) subscribePresence(names.toList())
+                    }
+            }
+
             // Listen for Message Status Updates (Delivered/Read)
             serviceScope.launch {
                 SocketClient.messageStatusUpdates.collect { data ->
@@ -130,16 +147,40 @@ class SocketService : Service() {
                 }
             }
 
+            // Listen for Batched Status Updates (one event for a whole opened chat)
+            serviceScope.launch {
+                SocketClient.messageStatusBatches.collect { data ->
+                    val ids = data.optJSONArray("messageIds") ?: return@collect
+                    val statusInt = when (data.optString("status")) {
+                        "delivered" -> 2
+                        "read" -> 3
+                        else -> 1
+                    }
+                    if (statusInt > 1 && ids.length() > 0) {
+                        val messageIds = (0 until ids.length()).map { ids.getString(it) }
+                        val dao = AppDatabase.getDatabase(applicationContext).messageDao()
+                        // SQLite caps bound parameters per statement
+                        messageIds.chunked(500).forEach { dao.updateDeliveryStatuses(it, statusInt) }
+                        Log.d("SocketService", "Updated ${messageIds.size} msgs status to $statusInt")
+                    }
+                }
+            }
+
             // Sync Missed Messages on Reconnect
             serviceScope.launch {
                 SocketClient.isConnected.collect { connected ->
                     if (connected) {
                          val dao = AppDatabase.getDatabase(applicationContext).messageDao()
                          val lastTimestamp = dao.getLastReceivedTimestamp() ?: 0L
+                         val lastSeq = UserPrefs.getLastSeq(applicationContext)
                          val user = UserPrefs.getUsername(applicationContext)
                          if (user != null) {
-                             SocketClient.emitSyncRequest(user, lastTimestamp)
-                             Log.d("SocketService", "Triggered Sync from $lastTimestamp")
+                             SocketClient.emitSyncRequest(user, lastSeq, lastTimestamp) { syncedSeq ->
+                                 // Seeds the cursor on the first (timestamp-based) sync; after that
+                                 // it advances as each message is stored
+                                 if (lastSeq == 0L) UserPrefs.updateLastSeq(applicationContext, syncedSeq)
+                             }
+                             Log.d("SocketService", "Triggered Sync from seq $lastSeq (timestamp $lastTimestamp)")
                          }
                     }
                 }
@@ -147,6 +188,22 @@ class SocketService : Service() {
         }
     }
 
+    private fun subscribePresence(names: List<String>) {
+        SocketClient.subscribePresence(names) { ack ->
+            serviceScope.launch {
+                if (ack.optString("error") == "rate_limited") {
+                    delay((ack.optDouble("retryAfter", 1.0) * 1000).toLong() + 100)
+                    subscribePresence(names)
+                    return@launch
+                }
+                val contactDao = AppDatabase.getDatabase(applicationContext).contactDao()
+                ack.keys().forEach { name ->
+                    contactDao.updateContactStatus(name, ack.optString(name) == "online")
+                }
+            }
+        }
+    }
+
     override fun onStartCommand(intent: Intent?, flags: Int, startId: Int): Int {
         // Always Start Foreground immediately to avoid crash
         val notification = createForegroundNotification()
@@ -168,6 +225,7 @@ class SocketService : Service() {
                 val sender = message.optString("sender")
                 val text = if (message.isNull("text")) null else message.getString("text")
                 val imageUrl = if (message.isNull("imageUrl")) null else message.getString("imageUrl")
+                val previewUrl = if (message.isNull("previewUrl")) null else message.getString("previewUrl")
                 val camouflageText = if (message.isNull("camouflageText")) null else message.getString("camouflageText")
                 val replyToId = if (message.isNull("replyToId")) null else message.getString("replyToId")
                 // Use current time if timestamp is missing or weird, but prefer message timestamp
@@ -195,6 +253,7 @@ class SocketService : Service() {
                     chatId = sender,
                     text = text,
                     imageUri = imageUrl,
+                    previewUri = previewUrl,
                     isFromMe = false,
                     isStego = imageUrl != null,
                     status = if (imageUrl != null) 2 else 4, // 2: REMOTE/PENDING, 4: RECEIVED/REVEALED (Text-only)
@@ -203,6 +262,10 @@ class SocketService : Service() {
                 )
                 dao.insertMessage(newMessage)
 
+                // Advance the delta-sync cursor only once the message is stored
+                val seq = message.optLong("seq", 0L)
+                if (seq > 0) UserPrefs.updateLastSeq(applicationContext, seq)
+
                 // 3. Update Last Message
                 val displayMsg = camouflageText?: text ?: (if (imageUrl != null) "Received an image" else "New Message")
                 contactDao.incrementUnreadCount(sender, displayMsg, timestamp)
@@ -210,9 +273,12 @@ class SocketService : Service() {
                 // 4. Notification
                 if (!isForground) {
                     var bitmap: android.graphics.Bitmap? = null
-                    if (imageUrl != null) {
+                    // Prefer the small preview; messages from older senders have none,
+                    // so fall back to the original as before
+                    val notificationImageUrl = previewUrl ?: imageUrl
+                    if (notificationImageUrl != null) {
                          try {
-                            val url = java.net.URL(imageUrl)
+                            val url = java.net.URL(notificationImageUrl)
                             bitmap = android.graphics.BitmapFactory.decodeStream(url.openConnection().getInputStream())
                         } catch (e: Exception) {
                             Log.e("SocketService", "Failed to download notification image", e)
@@ -19,6 +19,20 @@ object UserPrefs {
         return getPrefs(context).getString(KEY_USERNAME, null)
     }
 
+    // Highest per-recipient sequence number received from the server (delta sync cursor)
+    private const val KEY_LAST_SEQ = "last_seq"
+
+    fun getLastSeq(context: Context): Long {
+        return getPrefs(context).getLong(KEY_LAST_SEQ, 0L)
+    }
+
+    @Synchronized
+    fun updateLastSeq(context: Context, seq: Long) {
+        if (seq > getLastSeq(context)) {
+            getPrefs(context).edit().putLong(KEY_LAST_SEQ, seq).apply()
+        }
+    }
+
     fun isLoggedIn(context: Context): Boolean {
         return !getUsername(context).isNullOrEmpty()
     }
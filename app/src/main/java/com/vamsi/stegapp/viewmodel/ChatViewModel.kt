@@ -29,6 +29,12 @@ import com.vamsi.stegapp.network.ProgressRequestBody
 
 class ChatViewModel(context: Context, private val chatId: String) : ViewModel() {
 
+    companion object {
+        // ETag of the last public key fetched per contact (process lifetime),
+        // sent as If-None-Match so an unchanged key comes back as an empty 304
+        private val keyEtags = java.util.concurrent.ConcurrentHashMap<String, String>()
+    }
+
     private val repository = StegoRepository(context)
     private val appContext = context.applicationContext
 
@@ -53,8 +59,9 @@ class ChatViewModel(context: Context, private val chatId: String) : ViewModel()
                     entities.filter { !it.isFromMe && it.deliveryStatus < 3 }
                 }.stateIn(viewModelScope, SharingStarted.Eagerly, emptyList()).value
                 
-                receivedMessages.forEach { msg ->
-                    SocketClient.emitMessageRead(msg.id, username)
+                // One batched receipt instead of one event per message
+                if (receivedMessages.isNotEmpty()) {
+                    SocketClient.emitMessagesRead(receivedMessages.map { it.id }, username)
                 }
                 
                 // 1. Try Load from DB Cache (Offline Support)
@@ -65,9 +72,14 @@ class ChatViewModel(context: Context, private val chatId: String) : ViewModel()
 
                 // 2. Fetch Fresh Key from Network (if online)
                 try {
-                    val response = NetworkModule.api.fetchKey(chatId)
-                    if (response.isSuccessful && response.body() != null) {
+                    // Only revalidate when there is a cached key to fall back on
+                    val etag = if (cachedContact?.publicKey != null) keyEtags[chatId] else null
+                    val response = NetworkModule.api.fetchKey(chatId, etag)
+                    if (response.code() == 304) {
+                        // Unchanged: the cached key is current
+                    } else if (response.isSuccessful && response.body() != null) {
                         val remoteKey = response.body()!!.publicKey
+                        response.headers()["ETag"]?.let { keyEtags[chatId] = it }
                         
                         // Save to DB
                         contactDao.updatePublicKey(chatId, remoteKey)
@@ -366,16 +378,10 @@ class ChatViewModel(context: Context, private val chatId: String) : ViewModel()
         viewModelScope.launch {
             try {
                 val file = File(path)
-                val requestFile = ProgressRequestBody(file, "image/png".toMediaTypeOrNull()) { progress ->
-                     _uploadProgress.update { it + (message.id to progress) }
-                }
-                val body = MultipartBody.Part.createFormData("file", file.name, requestFile)
-                
-                val response = NetworkModule.api.uploadImage(body)
-                if (response.isSuccessful && response.body() != null) {
-                    val url = response.body()!!.url
+
+                suspend fun sendUploaded(url: String, previewUrl: String?) {
                     val username = UserPrefs.getUsername(appContext) ?: "Anonymous"
-                    
+
                     // Update Status to SENT (0)
                     dao.insertMessage(message.toEntity().copy(status = 0, deliveryStatus = 1))
 
@@ -383,12 +389,36 @@ class ChatViewModel(context: Context, private val chatId: String) : ViewModel()
                         id = message.id,
                         text = null, 
                         imageUrl = url, 
+                        previewUrl = previewUrl,
                         sender = username,
                         recipient = chatId,
                         camouflageText = camouflageText,
                         timestamp = message.timestamp
                     )
                     _uploadProgress.update { it - message.id }
+                }
+
+                // Ask the server before sending any bytes: an identical image
+                // (same SHA-256) is never uploaded twice
+                val contentHash = kotlinx.coroutines.withContext(kotlinx.coroutines.Dispatchers.IO) { sha256Hex(file) }
+                val existing = try {
+                    NetworkModule.api.uploadExists(contentHash).body()
+                } catch (e: Exception) {
+                    null // Fall back to a normal upload
+                }
+                if (existing?.exists == true && existing.url != null) {
+                    sendUploaded(existing.url, existing.previewUrl)
+                    return@launch
+                }
+
+                val requestFile = ProgressRequestBody(file, "image/png".toMediaTypeOrNull()) { progress ->
+                     _uploadProgress.update { it + (message.id to progress) }
+                }
+                val body = MultipartBody.Part.createFormData("file", file.name, requestFile)
+                
+                val response = NetworkModule.api.uploadImage(body)
+                if (response.isSuccessful && response.body() != null) {
+                    sendUploaded(response.body()!!.url, response.body()!!.previewUrl)
                 } else {
                     val errorBody = response.errorBody()?.string()
                     _error.value = if (!errorBody.isNullOrBlank()) {
@@ -414,6 +444,19 @@ class ChatViewModel(context: Context, private val chatId: String) : ViewModel()
         }
     }
 
+    private fun sha256Hex(file: File): String {
+        val digest = java.security.MessageDigest.getInstance("SHA-256")
+        file.inputStream().use { input ->
+            val buffer = ByteArray(64 * 1024)
+            while (true) {
+                val read = input.read(buffer)
+                if (read < 0) break
+                digest.update(buffer, 0, read)
+            }
+        }
+        return digest.digest().joinToString("") { "%02x".format(it) }
+    }
+
     private fun copyUriToTempFile(uri: Uri): String? {
         return try {
             val contentResolver = appContext.contentResolver
@@ -490,6 +533,7 @@ private fun MessageEntity.toDomain(): Message {
         chatId = chatId,
         text = text,
         imageUri = imageUri?.let { Uri.parse(it) },
+        previewUri = previewUri?.let { Uri.parse(it) },
         isFromMe = isFromMe,
         isStego = isStego,
         status = status,
@@ -505,6 +549,7 @@ private fun Message.toEntity(): MessageEntity {
         chatId = chatId,
         text = text,
         imageUri = imageUri?.toString(),
+        previewUri = previewUri?.toString(),
         isFromMe = isFromMe,
         isStego = isStego,
         status = status,
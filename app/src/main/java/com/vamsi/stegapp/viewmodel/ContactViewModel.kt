@@ -12,9 +12,12 @@ import kotlinx.coroutines.flow.combine
 import kotlinx.coroutines.flow.MutableStateFlow
 import kotlinx.coroutines.flow.asStateFlow
 import kotlinx.coroutines.flow.debounce
+import kotlinx.coroutines.flow.first
 import kotlinx.coroutines.flow.flatMapLatest
 import kotlinx.coroutines.flow.map
 import com.vamsi.stegapp.data.db.MessageEntity
+import com.vamsi.stegapp.network.NetworkModule
+import com.vamsi.stegapp.network.UsernameListRequest
 import java.util.UUID
 
 data class HomeUiState(
@@ -25,6 +28,11 @@ data class HomeUiState(
 
 class ContactViewModel(private val context: Context) : ViewModel() {
 
+    companion object {
+        // Server limit for one /check_users request
+        private const val MAX_USERNAME_BATCH = 500
+    }
+
     private val dao = AppDatabase.getDatabase(context).contactDao()
     private val messageDao = AppDatabase.getDatabase(context).messageDao()
 
@@ -63,7 +71,26 @@ class ContactViewModel(private val context: Context) : ViewModel() {
 
     init {
         viewModelScope.launch {
-            // Initial setup if needed
+            syncContacts()
+        }
+    }
+
+    // Refresh public keys and presence for every contact with one
+    // /check_users round trip per MAX_USERNAME_BATCH names
+    private suspend fun syncContacts() {
+        try {
+            val names = dao.getAllContacts().first().map { it.name }
+            names.chunked(MAX_USERNAME_BATCH).forEach { chunk ->
+                val response = NetworkModule.api.checkUsers(UsernameListRequest(chunk))
+                val users = response.body()?.users ?: return@forEach
+                users.forEach { (name, user) ->
+                    user.publicKey?.let { dao.updatePublicKey(name, it) }
+                    dao.updateContactStatus(name, user.status == "online")
+                }
+            }
+        } catch (e: Exception) {
+            // Offline: keep the cached keys and statuses
+            android.util.Log.w("ContactViewModel", "Contact sync failed", e)
         }
     }
 
@@ -75,14 +102,17 @@ class ContactViewModel(private val context: Context) : ViewModel() {
         }
         viewModelScope.launch {
             try {
-                // Verify user exists on backend
-                val response = com.vamsi.stegapp.network.NetworkModule.api.checkUser(name)
-                if (response.isSuccessful && response.body()?.exists == true) {
+                // Verify user exists on backend (and pick up their key and presence)
+                val response = NetworkModule.api.checkUsers(UsernameListRequest(listOf(name)))
+                val user = response.body()?.users?.get(name)
+                if (response.isSuccessful && user != null) {
                     val newContact = ContactEntity(
                         id = UUID.randomUUID().toString(),
                         name = name,
                         lastMessage = "Start a conversation",
-                        lastMessageTime = System.currentTimeMillis()
+                        lastMessageTime = System.currentTimeMillis(),
+                        isOnline = user.status == "online",
+                        publicKey = user.publicKey
                     )
                     dao.insertContact(newContact)
                     launch(kotlinx.coroutines.Dispatchers.Main) {
@@ -4,9 +4,11 @@ from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.backends import default_backend
 from PIL import Image
 import numpy as np
+import lz4.block
 import lz4.frame
 import os
 import sys
+import zlib
 
 # Common Utilities
 
@@ -44,12 +46,123 @@ def decrypt_chacha20(salt, nonce, ciphertext, password):
     return decryptor.update(ciphertext)
 
 
+# Payload Codec
+#
+# Every payload bit costs pixel pairs, so messages are packed as small as
+# possible before encryption. The first byte is a header: format version in
+# the high nibble, compression method in the low nibble. Two bytes of check
+# (low 16 bits of the CRC-32 of the UTF-8 text) follow, so a wrong password
+# is reported as an error instead of decoding to garbage. The encoder tries
+# every method and keeps the smallest result:
+#   raw      - UTF-8 as is (best for very short texts)
+#   lz4      - LZ4 block, no frame header; a varint holds the original size
+#   deflate  - raw deflate primed with CHAT_DICTIONARY
+# The ciphertext length is sent in the bit header, so no end marker is needed.
+# Payloads written before the codec existed (an LZ4 frame around
+# "message||END||") are still decoded.
+#
+# App releases before this codec (and StegScripts/Extract_security.py before
+# it was updated) can only read the legacy frame. embed_pvd(legacy_payload=True)
+# still writes it, for as long as such readers have to be supported.
+
+PAYLOAD_VERSION = 1
+METHOD_RAW = 0
+METHOD_LZ4 = 1
+METHOD_DEFLATE = 2
+LZ4_FRAME_MAGIC = b"\x04\x22\x4d\x18"
+LZ4_MAX_RATIO = 255  # an LZ4 block never expands more than this
+
+# Preset dictionary for deflate: common chat words and phrases, most
+# frequent last (deflate finds closer matches with shorter distances).
+# Changing it breaks decoding of existing images: add a new
+# PAYLOAD_VERSION instead.
+CHAT_DICTIONARY = (
+    "http://https://www..com/ meeting tomorrow morning tonight weekend "
+    "birthday congratulations appreciate definitely probably actually "
+    "address location password remember something everything anything "
+    "because before after again already always never maybe sorry please "
+    "thank you thanks so much love you miss you take care good night "
+    "good morning see you soon talk later on my way be there in 10 minutes "
+    "let me know call me when you get this can you send me the "
+    "what time are we still on for did you see the where are you "
+    "I think I don't know I'm not sure I will I can't wait haha lol ok okay "
+    "yes no yeah sure cool great nice awesome hey hi hello how are you "
+    "what's up are you free do you want to I'll be there just "
+    "the and that this with have for you it is in to of a I "
+).encode("utf-8")
+
+def _varint(n):
+    out = bytearray()
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def _read_varint(data, pos):
+    n = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return n, pos
+        shift += 7
+
+def _deflate(raw):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, CHAT_DICTIONARY)
+    return compressor.compress(raw) + compressor.flush()
+
+def _check(raw):
+    return (zlib.crc32(raw) & 0xFFFF).to_bytes(2, "big")
+
+def encode_payload(message, legacy=False):
+    if legacy:
+        return lz4.frame.compress((message + "||END||").encode("utf-8"))
+    raw = message.encode("utf-8")
+    candidates = [
+        (METHOD_RAW, raw),
+        (METHOD_LZ4, _varint(len(raw)) + lz4.block.compress(raw, mode="high_compression", store_size=False)),
+        (METHOD_DEFLATE, _deflate(raw)),
+    ]
+    method, body = min(candidates, key=lambda c: len(c[1]))
+    return bytes([(PAYLOAD_VERSION << 4) | method]) + _check(raw) + body
+
+def decode_payload(payload):
+    if payload[:4] == LZ4_FRAME_MAGIC:
+        # Legacy format
+        return lz4.frame.decompress(payload).decode("utf-8").split("||END||")[0]
+
+    version, method = payload[0] >> 4, payload[0] & 0x0F
+    if version != PAYLOAD_VERSION:
+        raise ValueError(f"Unsupported payload version {version}")
+    check, body = payload[1:3], payload[3:]
+    if method == METHOD_RAW:
+        raw = body
+    elif method == METHOD_LZ4:
+        size, pos = _read_varint(body, 0)
+        # The size comes from decrypted bytes (garbage under a wrong
+        # password): bound it before anything is allocated
+        if size > (len(body) - pos) * LZ4_MAX_RATIO:
+            raise ValueError("Invalid payload size")
+        raw = lz4.block.decompress(body[pos:], uncompressed_size=size)
+    elif method == METHOD_DEFLATE:
+        decompressor = zlib.decompressobj(-15, zdict=CHAT_DICTIONARY)
+        raw = decompressor.decompress(body) + decompressor.flush()
+    else:
+        raise ValueError(f"Unknown payload method {method}")
+    if _check(raw) != check:
+        raise ValueError("Payload check failed (wrong password?)")
+    return raw.decode("utf-8")
+
+
 # Embed Logic
 
-def message_to_bits(message, password):
-    message_with_marker = (message + "||END||").encode("utf-8")
-    compressed = lz4.frame.compress(message_with_marker)
-    salt, nonce, encrypted = encrypt_message_chacha20(compressed, password)
+def message_to_bits(message, password, legacy_payload=False):
+    salt, nonce, encrypted = encrypt_message_chacha20(encode_payload(message, legacy_payload), password)
 
     bits = "01000101"  # 'E' marker
     bits += format(len(encrypted), '032b')
@@ -59,13 +172,13 @@ def message_to_bits(message, password):
         bits += format(b, '08b')
     return bits
 
-def embed_pvd(image_path, message, output_path, password):
+def embed_pvd(image_path, message, output_path, password, legacy_payload=False):
     try:
         img = Image.open(image_path).convert("RGB")
         width, height = img.size
         pixels = np.array(img, dtype=int)
 
-        bits_to_embed = message_to_bits(message, password)
+        bits_to_embed = message_to_bits(message, password, legacy_payload)
         total_bits = len(bits_to_embed)
         bit_idx = 0
 
@@ -142,8 +255,7 @@ def bits_to_message(bits, password):
         ciphertext = bytes(encrypted_bytes[32:])
 
         decrypted = decrypt_chacha20(salt, nonce, ciphertext, password)
-        decompressed = lz4.frame.decompress(decrypted)
-        return decompressed.decode('utf-8').split("||END||")[0]
+        return decode_payload(decrypted)
         
     except Exception as e:
         return f"[Extraction Failed] {e}"
@@ -177,6 +289,11 @@ def extract_pvd(image_path, password):
         elif diff < 64:    n_bits = 4
         else:              n_bits = 5
 
+        # The last pair carries only the remaining bits (mirrors embed_pvd)
+        remaining = total_bits_to_read - bit_count
+        if n_bits > remaining:
+            n_bits = remaining
+
         d_prime = diff % (2 ** n_bits)
         extracted_bits.append(f'{d_prime:0{n_bits}b}')
         bit_count += n_bits
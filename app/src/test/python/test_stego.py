@@ -0,0 +1,118 @@
+import importlib.util
+import os
+import sys
+
+import lz4.frame
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "main", "python"))
+
+import stego  # noqa: E402
+
+SHORT = "hi"
+CHATTY = "hey, are you free tomorrow morning? let me know when you get this, thanks so much!"
+REPETITIVE = "abcdefgh" * 64
+
+
+def _force_method(monkeypatch, method):
+    # Bloat the other compressed candidates so encode_payload keeps `method`.
+    # Raw can't be bloated, so compressible messages are used for lz4/deflate.
+    real_deflate = stego._deflate
+    real_compress = stego.lz4.block.compress
+    if method != stego.METHOD_DEFLATE:
+        monkeypatch.setattr(stego, "_deflate", lambda raw: real_deflate(raw) + bytes(100000))
+    if method != stego.METHOD_LZ4:
+        monkeypatch.setattr(stego.lz4.block, "compress", lambda *a, **kw: real_compress(*a, **kw) + bytes(100000))
+
+
+@pytest.mark.parametrize("message", [SHORT, CHATTY, REPETITIVE, "", "héllo 👋 — ünïcode"])
+def test_payload_round_trip(message):
+    assert stego.decode_payload(stego.encode_payload(message)) == message
+
+
+@pytest.mark.parametrize("message,method", [
+    (SHORT, stego.METHOD_RAW),
+    (REPETITIVE, stego.METHOD_LZ4),
+    (REPETITIVE, stego.METHOD_DEFLATE),
+    (CHATTY, stego.METHOD_DEFLATE),
+])
+def test_payload_method_round_trip(monkeypatch, message, method):
+    _force_method(monkeypatch, method)
+    payload = stego.encode_payload(message)
+    assert payload[0] == (stego.PAYLOAD_VERSION << 4) | method
+    assert stego.decode_payload(payload) == message
+
+
+def test_legacy_lz4_frame():
+    payload = lz4.frame.compress(("old message" + "||END||").encode("utf-8"))
+    assert stego.decode_payload(payload) == "old message"
+
+
+def test_legacy_payload_is_written_on_request():
+    payload = stego.encode_payload("old reader", legacy=True)
+    assert payload[:4] == stego.LZ4_FRAME_MAGIC
+    assert stego.decode_payload(payload) == "old reader"
+
+
+def test_oversized_lz4_size_is_rejected(monkeypatch):
+    def decompress(*args, **kwargs):
+        raise AssertionError("decompress must not be reached")
+    monkeypatch.setattr(stego.lz4.block, "decompress", decompress)
+    payload = bytes([(stego.PAYLOAD_VERSION << 4) | stego.METHOD_LZ4]) + b"\0\0" + stego._varint(2 ** 40) + b"xyz"
+    with pytest.raises(ValueError):
+        stego.decode_payload(payload)
+
+
+def test_corrupted_payload_is_rejected():
+    payload = bytearray(stego.encode_payload(CHATTY))
+    payload[1] ^= 0xFF
+    with pytest.raises(ValueError):
+        stego.decode_payload(bytes(payload))
+
+
+def test_unknown_version_is_rejected():
+    payload = stego.encode_payload(SHORT)
+    with pytest.raises(ValueError):
+        stego.decode_payload(bytes([(stego.PAYLOAD_VERSION + 1) << 4]) + payload[1:])
+
+
+def test_wrong_password_is_reported():
+    bits = stego.message_to_bits(CHATTY, "right")
+    assert stego.bits_to_message(bits, "wrong").startswith(("[Error", "[Extraction Failed"))
+
+
+@pytest.fixture
+def cover(tmp_path):
+    rng = np.random.default_rng(7)
+    path = tmp_path / "cover.png"
+    Image.fromarray(rng.integers(0, 256, (64, 64, 3), dtype=np.uint8)).save(path)
+    return path
+
+
+@pytest.mark.parametrize("message", [SHORT, CHATTY, REPETITIVE, "héllo 👋 — ünïcode"])
+def test_embed_extract_round_trip(cover, tmp_path, message):
+    # A noisy cover gives most pairs 4-5 bits, so the last pair is almost
+    # always truncated; extract_pvd has to stop exactly where embed_pvd did.
+    out = tmp_path / "stego.png"
+    result = stego.embed_pvd(str(cover), message, str(out), "secret")
+    assert result == f"SUCCESS:{out}"
+    assert stego.extract_pvd(str(out), "secret") == message
+
+
+def test_embed_legacy_payload(cover, tmp_path):
+    out = tmp_path / "stego.png"
+    stego.embed_pvd(str(cover), CHATTY, str(out), "secret", legacy_payload=True)
+    assert stego.extract_pvd(str(out), "secret") == CHATTY
+
+
+def test_desktop_extract_script_reads_app_images(cover, tmp_path):
+    path = os.path.join(os.path.dirname(__file__), "..", "..", "..", "..", "StegScripts", "Extract_security.py")
+    spec = importlib.util.spec_from_file_location("extract_security", path)
+    script = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(script)
+    for legacy in (False, True):
+        out = tmp_path / f"stego-{legacy}.png"
+        stego.embed_pvd(str(cover), CHATTY, str(out), "secret", legacy_payload=legacy)
+        assert script.extract_pvd(str(out), "secret") == CHATTY
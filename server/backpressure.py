@@ -0,0 +1,218 @@
+import asyncio
+import functools
+import itertools
+import logging
+import time
+from collections import OrderedDict
+
+from metrics import THROTTLED_EVENTS, OUTBOUND_COALESCED, OUTBOUND_DROPPED, SLOW_CONSUMER_DISCONNECTS
+
+logger = logging.getLogger("stegapp.backpressure")
+
+# Status events can be merged or dropped for a slow consumer: a newer status
+# supersedes an older one, and clients can recover anything missed through
+# sync_messages / subscribe_presence. Messages and deletions are never dropped.
+COALESCED_EVENTS = ("message_status", "message_status_batch", "user_status")
+# A message's status only moves forward: a queued 'read' is never replaced
+# by a later 'delivered' (e.g. one re-sent by a sync).
+STATUS_RANK = {"delivered": 1, "read": 2}
+
+
+class TokenBucket:
+    """
+    Classic token bucket: `rate` tokens per second, up to `burst` banked.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def retry_after(self):
+        """
+        Seconds until the next token is available.
+        """
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class RateLimiter:
+    """
+    Token buckets per connection and per event type.
+    limits: { event: (rate per second, burst) }; events without an entry
+    (or with a rate of 0) are not limited.
+    """
+
+    def __init__(self, limits):
+        self.limits = {event: limit for event, limit in limits.items() if limit[0] > 0}
+        self.buckets = {}  # sid -> { event: TokenBucket }
+
+    def allow(self, sid, event):
+        limit = self.limits.get(event)
+        if limit is None:
+            return True
+        buckets = self.buckets.setdefault(sid, {})
+        bucket = buckets.get(event)
+        if bucket is None:
+            bucket = buckets[event] = TokenBucket(*limit)
+        return bucket.take()
+
+    def retry_after(self, sid, event):
+        bucket = self.buckets.get(sid, {}).get(event)
+        return bucket.retry_after() if bucket else 0.0
+
+    def discard(self, sid):
+        self.buckets.pop(sid, None)
+
+    def limit(self, handler=None, overflow=None):
+        """
+        Decorator for event handlers taking (sid, data): over-limit events are
+        counted and rejected before any work is done. The ack (if requested)
+        tells the client when to retry.
+        With @limit(overflow=fn), over-limit events are handed to fn(sid, data)
+        instead (e.g. to defer them), and its result is the ack.
+        Apply below @instrument_event.
+        """
+        if handler is None:
+            return functools.partial(self.limit, overflow=overflow)
+        event = handler.__name__
+
+        @functools.wraps(handler)
+        async def wrapper(sid, data=None):
+            if not self.allow(sid, event):
+                THROTTLED_EVENTS.labels(event).inc()
+                if overflow is not None:
+                    return await overflow(sid, data)
+                return {"error": "rate_limited", "retryAfter": round(self.retry_after(sid, event), 3)}
+            return await handler(sid, data)
+
+        return wrapper
+
+
+def parse_limit(value):
+    """
+    "rate/burst" (e.g. "20/40") -> (20.0, 40.0). "0" or "off" disables the limit.
+    """
+    if value.strip().lower() in ("0", "off", ""):
+        return (0.0, 0.0)
+    rate, _, burst = value.partition("/")
+    rate = float(rate)
+    return (rate, float(burst) if burst else max(1.0, rate))
+
+
+class OutboundQueues:
+    """
+    Bounded per-connection outbound queues.
+
+    While a connection keeps up, events are emitted straight away. Once its
+    transport backlog (packets Socket.IO has queued but not yet written)
+    reaches `high_water`, further events wait in a per-connection queue that
+    a drain task feeds to the transport as the backlog clears. While waiting,
+    status events are coalesced (the furthest status per message and the
+    newest status per user win, batches are merged); beyond `max_pending`, status events are dropped and
+    a connection that still cannot absorb its messages is disconnected, so it
+    reconnects and catches up with a delta sync instead of growing memory.
+
+    send(sid, event, data)  coroutine that writes one event
+    backlog(sid)            transport packets waiting for this connection
+    disconnect(sid)         coroutine that drops a connection
+    """
+
+    def __init__(self, send, backlog, disconnect, high_water=64, max_pending=1000, drain_interval=0.05):
+        self.send = send
+        self.backlog = backlog
+        self.disconnect = disconnect
+        self.high_water = high_water
+        self.max_pending = max_pending
+        self.drain_interval = drain_interval
+        self.pending = {}  # sid -> OrderedDict(key -> [event, data])
+        self.tasks = {}    # sid -> drain task
+        self._keys = itertools.count()
+
+    def __len__(self):
+        return sum(len(queue) for queue in self.pending.values())
+
+    async def put(self, sid, event, data, block=False):
+        """
+        Emit or queue one event. With block=True a full queue makes the
+        caller wait for it to drain instead (used for replays the connection
+        itself asked for, which must not get it disconnected).
+        """
+        queue = self.pending.get(sid)
+        while block and queue and len(queue) >= self.max_pending and sid in self.tasks:
+            await asyncio.sleep(self.drain_interval)
+            queue = self.pending.get(sid)
+        if not queue and self.backlog(sid) < self.high_water:
+            await self.send(sid, event, data)
+            return
+
+        if queue is None:
+            queue = self.pending[sid] = OrderedDict()
+        key = self._coalesce_key(event, data)
+        if key is not None and key in queue:
+            entry = queue[key]
+            if event == "message_status_batch":
+                entry[1] = {**entry[1], "messageIds": entry[1]["messageIds"] + data["messageIds"]}
+            elif event == "message_status":
+                if STATUS_RANK.get(data.get("status"), 0) >= STATUS_RANK.get(entry[1].get("status"), 0):
+                    entry[1] = data
+            else:
+                entry[1] = data
+            OUTBOUND_COALESCED.labels(event).inc()
+            return
+
+        if len(queue) >= self.max_pending:
+            if event in COALESCED_EVENTS:
+                OUTBOUND_DROPPED.labels(event).inc()
+                return
+            SLOW_CONSUMER_DISCONNECTS.inc()
+            logger.warning("Disconnecting slow consumer %s (%d events pending)", sid, len(queue))
+            self.discard(sid)
+            await self.disconnect(sid)
+            return
+
+        queue[key if key is not None else next(self._keys)] = [event, data]
+        task = self.tasks.get(sid)
+        if task is None or task.done():
+            self.tasks[sid] = asyncio.create_task(self._drain(sid))
+
+    def _coalesce_key(self, event, data):
+        if event == "message_status":
+            return (event, data.get("messageId"))
+        if event == "message_status_batch":
+            return (event, data.get("status"))
+        if event == "user_status":
+            return (event, data.get("username"))
+        return None
+
+    async def _drain(self, sid):
+        while self.pending.get(sid):
+            if self.backlog(sid) >= self.high_water:
+                await asyncio.sleep(self.drain_interval)
+                continue
+            queue = self.pending[sid]
+            _, (event, data) = queue.popitem(last=False)
+            try:
+                await self.send(sid, event, data)
+            except Exception as e:
+                logger.warning("Outbound %s to %s failed: %s", event, sid, e)
+        self.pending.pop(sid, None)
+        self.tasks.pop(sid, None)
+
+    def discard(self, sid):
+        """
+        Forget a connection's queue (on disconnect).
+        """
+        self.pending.pop(sid, None)
+        task = self.tasks.pop(sid, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
@@ -0,0 +1,89 @@
+"""
+Wire-size and CPU benchmark: JSON vs. the compact msgpack codec.
+
+Encodes realistic events into complete Socket.IO packets exactly as the
+server sends them (binary payloads travel as attachments) and reports
+bytes on the wire and encode time per event:
+
+    python bench_codec.py --messages 20000
+"""
+import argparse
+import time
+import uuid
+
+from socketio import packet
+
+from codec import encode_payload
+
+SAMPLE_MESSAGE = {
+    "id": None,
+    "text": None,
+    "imageUrl": "https://res.cloudinary.com/demo/image/upload/v1700000000/" + "3f2a9c1e" * 8 + ".png",
+    "sender": "alice_w",
+    "recipient": "bob_k",
+    "camouflageText": "Look at this sunset!",
+    "timestamp": 1760000000000,
+    "replyToId": None,
+    "seq": 1234,
+    "previewUrl": "https://res.cloudinary.com/demo/image/upload/c_limit,h_320,q_60,w_320/" + "3f2a9c1e" * 8 + ".jpg"
+}
+
+
+def wire_size(pkt):
+    """
+    Bytes on a websocket: one text frame, plus one binary frame per attachment.
+    """
+    encoded = pkt.encode()
+    if isinstance(encoded, list):
+        return len(encoded[0]) + 1 + sum(len(part) for part in encoded[1:])
+    return len(encoded) + 1
+
+
+def make_packet(event, data, use_msgpack):
+    if use_msgpack:
+        data = encode_payload(event, data)
+    return packet.Packet(packet.EVENT, data=[event, data])
+
+
+def measure(events, use_msgpack):
+    """
+    Returns (total bytes, seconds spent encoding) for a list of (event, data).
+    """
+    start = time.perf_counter()
+    total = 0
+    for event, data in events:
+        total += wire_size(make_packet(event, data, use_msgpack))
+    return total, time.perf_counter() - start
+
+
+def report(label, events, count):
+    json_bytes, json_time = measure(events, use_msgpack=False)
+    mp_bytes, mp_time = measure(events, use_msgpack=True)
+    print(f"{label}")
+    print(f"  JSON     {json_bytes / count:8.1f} B/msg   {json_time / count * 1e6:7.2f} us/msg")
+    print(f"  msgpack  {mp_bytes / count:8.1f} B/msg   {mp_time / count * 1e6:7.2f} us/msg"
+          f"   ({mp_bytes / json_bytes - 1:+.0%} bytes)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Socket.IO payload codec benchmark")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--batch", type=int, default=200, help="Read receipts per opened chat")
+    args = parser.parse_args()
+
+    ids = [str(uuid.uuid4()) for _ in range(args.messages)]
+    messages = [("new_message", {**SAMPLE_MESSAGE, "id": message_id}) for message_id in ids]
+    statuses = [("message_status", {"messageId": message_id, "status": "read"}) for message_id in ids]
+    batches = [
+        ("message_status_batch", {"messageIds": ids[i:i + args.batch], "status": "read"})
+        for i in range(0, len(ids), args.batch)
+    ]
+
+    print(f"--- Codec Benchmark ({args.messages} messages) ---")
+    report("new_message", messages, len(messages))
+    report("message_status (one event per receipt)", statuses, len(statuses))
+    report(f"message_status_batch ({args.batch} receipts per event)", batches, len(statuses))
+
+
+if __name__ == "__main__":
+    main()
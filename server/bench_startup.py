@@ -0,0 +1,110 @@
+"""
+Startup benchmark for the StegApp server.
+
+Measures, over several fresh processes:
+  - import time of main.py
+  - time from process launch to the first successful /healthz
+  - time from process launch to /readyz reporting ready (Mongo warm-up done)
+
+Uses MONGODB_URI from the environment, or the in-memory mongomock stand-in
+when it is not set:
+
+    python bench_startup.py --runs 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+IMPORT_SNIPPET = (
+    "import time; start = time.perf_counter(); import main; "
+    "print(time.perf_counter() - start)"
+)
+
+
+def server_env():
+    env = dict(os.environ)
+    env.setdefault("MONGODB_URI", "mongomock://localhost")
+    env.setdefault("LOG_LEVEL", "WARNING")
+    return env
+
+
+def measure_import():
+    out = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET],
+        cwd=SERVER_DIR, env=server_env(), capture_output=True, text=True, check=True
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def poll(url, deadline):
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as resp:
+                if resp.status == 200:
+                    return time.perf_counter()
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.01)
+    return None
+
+
+def measure_serving(port, timeout):
+    """
+    Returns (seconds to first /healthz, seconds to /readyz) for one launch.
+    """
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=SERVER_DIR, env=server_env()
+    )
+    try:
+        deadline = start + timeout
+        healthy = poll(f"http://127.0.0.1:{port}/healthz", deadline)
+        ready = poll(f"http://127.0.0.1:{port}/readyz", deadline)
+        return (
+            healthy - start if healthy else None,
+            ready - start if ready else None
+        )
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def summarize(label, samples):
+    samples = [s for s in samples if s is not None]
+    if not samples:
+        print(f"{label:<22} no successful runs")
+        return
+    print(f"{label:<22} median {statistics.median(samples) * 1000:8.1f} ms   "
+          f"min {min(samples) * 1000:8.1f} ms   max {max(samples) * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="StegApp startup benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds to wait for each launch")
+    args = parser.parse_args()
+
+    imports, healthz, readyz = [], [], []
+    for _ in range(args.runs):
+        imports.append(measure_import())
+        first, ready = measure_serving(args.port, args.timeout)
+        healthz.append(first)
+        readyz.append(ready)
+
+    print(f"\n--- Startup Benchmark ({args.runs} runs) ---")
+    summarize("Import main.py", imports)
+    summarize("Launch -> /healthz", healthz)
+    summarize("Launch -> /readyz", readyz)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Compact MessagePack encoding for Socket.IO event payloads.
+
+Clients opt in per connection with ?codec=msgpack on the connect URL.
+Event names stay the same, but each payload becomes a single binary
+argument holding a msgpack value. Hot events use positional arrays
+instead of key names:
+
+    new_message           [id, text, imageUrl, sender, recipient,
+                           camouflageText, timestamp, replyToId, seq,
+                           previewUrl]
+    message_status        [status, [messageId]]
+    message_status_batch  [status, [messageId, ...]]
+    user_status           [username, online]          (online: 1 or 0)
+
+status is 2 for delivered and 3 for read, the same numbers the app stores.
+Every other event is the msgpack encoding of its usual JSON object.
+Clients may send send_message as a new_message array and
+messages_read as [[messageId, ...], reader]; everything else as a
+msgpack map. Connections without the query parameter keep plain JSON.
+"""
+import functools
+
+import msgpack
+
+CODEC_JSON = "json"
+CODEC_MSGPACK = "msgpack"
+CODECS = (CODEC_JSON, CODEC_MSGPACK)
+
+MESSAGE_FIELDS = ("id", "text", "imageUrl", "sender", "recipient", "camouflageText", "timestamp", "replyToId", "seq", "previewUrl")
+STATUS_CODES = {"delivered": 2, "read": 3}
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+
+
+def encode_payload(event, data):
+    """
+    JSON-style payload -> compact msgpack bytes for the given event.
+    """
+    if event == "new_message":
+        value = [data.get(field) for field in MESSAGE_FIELDS]
+    elif event == "message_status":
+        value = [STATUS_CODES.get(data["status"], data["status"]), [data["messageId"]]]
+    elif event == "message_status_batch":
+        value = [STATUS_CODES.get(data["status"], data["status"]), data["messageIds"]]
+    elif event == "user_status":
+        value = [data["username"], 1 if data["status"] == "online" else 0]
+    else:
+        value = data
+    return msgpack.packb(value, use_bin_type=True)
+
+
+def decode_payload(event, payload):
+    """
+    Inbound msgpack bytes -> the dict the JSON handlers expect.
+    Non-bytes payloads (JSON clients) are returned unchanged.
+    """
+    if not isinstance(payload, (bytes, bytearray)):
+        return payload
+
+    value = msgpack.unpackb(payload, raw=False)
+    if isinstance(value, list):
+        if event == "send_message":
+            return dict(zip(MESSAGE_FIELDS, value))
+        if event == "messages_read":
+            return {"messageIds": value[0], "reader": value[1] if len(value) > 1 else None}
+        raise ValueError(f"Positional msgpack payload not supported for {event}")
+    return value
+
+
+def accepts_msgpack(handler):
+    """
+    Decorator for event handlers taking (sid, data): decodes msgpack data.
+    """
+    event = handler.__name__
+
+    @functools.wraps(handler)
+    async def wrapper(sid, data=None):
+        return await handler(sid, decode_payload(event, data))
+
+    return wrapper
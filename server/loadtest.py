@@ -0,0 +1,367 @@
+"""
+Socket.IO load generator for the StegApp server.
+
+Simulates many concurrent clients that connect with ?username=, exchange
+send_message traffic, acknowledge it with message_read and periodically
+call sync_messages. A fraction of sends (--upload-ratio) first upload a
+generated PNG to /upload/ and send its URL, as the app does; the images
+come from a fixed pool, so repeats exercise the deduplication path.
+By default a local server is started with an in-memory Mongo stand-in
+(mongomock) and the local storage backend, so the whole run is offline:
+
+    pip install aiohttp mongomock Pillow
+    python loadtest.py --clients 1000 --duration 60
+
+Pass --url to target an already running server instead.
+Note: each simulated client holds its own connection, so large runs may
+need a higher open-file limit (ulimit -n).
+"""
+import argparse
+import asyncio
+import io
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import aiohttp
+import socketio
+from PIL import Image
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class Stats:
+    def __init__(self):
+        self.sent = 0
+        self.delivered = 0
+        self.duplicates = 0
+        self.statuses = 0
+        self.syncs = 0
+        self.reads = 0
+        self.uploads = 0
+        self.deduplicated = 0
+        self.upload_latencies = []
+        self.errors = {}
+        self.in_flight = {}  # message id -> perf_counter() at send time
+        self.latencies = []
+        self.loop_lag = []
+
+    def error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class SimClient:
+    """
+    One simulated app user with its own Socket.IO connection.
+    """
+
+    def __init__(self, username, stats, args, http=None, images=()):
+        self.username = username
+        self.stats = stats
+        self.args = args
+        self.http = http
+        self.images = images
+        self.last_seq = 0
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.sio.on("new_message", self.on_new_message)
+        self.sio.on("message_status", self.on_status)
+        self.sio.on("message_status_batch", self.on_status)
+
+    async def on_new_message(self, data):
+        sent_at = self.stats.in_flight.pop(data.get("id"), None)
+        if sent_at is None:
+            # Redelivery via sync or offline replay
+            self.stats.duplicates += 1
+        else:
+            self.stats.delivered += 1
+            self.stats.latencies.append(time.perf_counter() - sent_at)
+        self.last_seq = max(self.last_seq, data.get("seq") or 0)
+
+        if random.random() < self.args.read_ratio:
+            await self.emit("message_read", {"messageId": data.get("id"), "reader": self.username})
+            self.stats.reads += 1
+
+    async def on_status(self, data):
+        self.stats.statuses += 1
+
+    async def emit(self, event, data):
+        try:
+            await self.sio.emit(event, data)
+        except Exception:
+            self.stats.error(f"emit:{event}")
+
+    async def connect(self, url):
+        try:
+            await self.sio.connect(f"{url}?username={self.username}", transports=["websocket"], wait_timeout=30)
+            return True
+        except Exception:
+            self.stats.error("connect")
+            return False
+
+    async def upload(self, url):
+        """
+        Upload one pool image; returns (url, previewUrl) or None on failure.
+        """
+        form = aiohttp.FormData()
+        form.add_field("file", random.choice(self.images), filename="load-test.png", content_type="image/png")
+        start = time.perf_counter()
+        try:
+            async with self.http.post(f"{url}/upload/", data=form) as resp:
+                if resp.status != 200:
+                    self.stats.error(f"upload:{resp.status}")
+                    return None
+                body = await resp.json()
+        except aiohttp.ClientError:
+            self.stats.error("upload")
+            return None
+        self.stats.upload_latencies.append(time.perf_counter() - start)
+        self.stats.uploads += 1
+        if body.get("deduplicated"):
+            self.stats.deduplicated += 1
+        return body["url"], body.get("previewUrl")
+
+    async def run(self, url, peers, deadline):
+        next_sync = time.monotonic() + self.args.sync_interval
+        while time.monotonic() < deadline:
+            await asyncio.sleep(random.expovariate(self.args.rate))
+            if not self.sio.connected:
+                self.stats.error("disconnected")
+                return
+
+            image_url, preview_url = self.args.image_url, None
+            if self.images and random.random() < self.args.upload_ratio:
+                uploaded = await self.upload(url)
+                if uploaded is None:
+                    continue
+                image_url, preview_url = uploaded
+
+            message_id = str(uuid.uuid4())
+            self.stats.in_flight[message_id] = time.perf_counter()
+            self.stats.sent += 1
+            await self.emit("send_message", {
+                "id": message_id,
+                "text": None,
+                "imageUrl": image_url,
+                "previewUrl": preview_url,
+                "sender": self.username,
+                "recipient": random.choice(peers),
+                "camouflageText": "load test",
+                "timestamp": int(time.time() * 1000),
+                "replyToId": None
+            })
+
+            if time.monotonic() >= next_sync:
+                next_sync += self.args.sync_interval
+                self.stats.syncs += 1
+                await self.emit("sync_messages", {"username": self.username, "lastSeq": self.last_seq})
+
+    async def close(self):
+        try:
+            await self.sio.disconnect()
+        except Exception:
+            pass
+
+
+async def monitor_loop_lag(stats, interval=0.1):
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        stats.loop_lag.append(max(0.0, time.perf_counter() - start - interval))
+
+
+async def wait_until_up(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(f"{url}/") as resp:
+                    if resp.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not come up within {timeout}s")
+
+
+def start_local_server(port, upload_dir):
+    env = dict(os.environ)
+    env.update({
+        "MONGODB_URI": "mongomock://localhost",
+        "STORAGE_BACKEND": "local",
+        "UPLOAD_DIR": upload_dir,
+        "LOG_LEVEL": "WARNING",
+    })
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=SERVER_DIR,
+        env=env
+    )
+
+
+def make_images(count, size):
+    """
+    `count` distinct noise PNGs of size x size pixels (noise barely
+    compresses, like real stego images).
+    """
+    images = []
+    for _ in range(count):
+        buffer = io.BytesIO()
+        Image.frombytes("RGB", (size, size), os.urandom(size * size * 3)).save(buffer, format="PNG")
+        images.append(buffer.getvalue())
+    return images
+
+
+async def register_users(url, usernames):
+    async with aiohttp.ClientSession() as session:
+        async def register(username):
+            async with session.post(f"{url}/register", json={"username": username}) as resp:
+                # 400 = already registered from an earlier run, which is fine
+                if resp.status not in (200, 400):
+                    raise RuntimeError(f"Register {username} failed: {resp.status}")
+        for i in range(0, len(usernames), 200):
+            await asyncio.gather(*(register(u) for u in usernames[i:i + 200]))
+
+
+async def scrape_server_loop_lag(url):
+    """
+    Returns (sum, count) of the server's stegapp_event_loop_lag_seconds histogram.
+    """
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"{url}/metrics") as resp:
+                body = await resp.text()
+    except aiohttp.ClientError:
+        return None
+    total = re.search(r"^stegapp_event_loop_lag_seconds_sum ([0-9.e+-]+)$", body, re.M)
+    count = re.search(r"^stegapp_event_loop_lag_seconds_count ([0-9.e+-]+)$", body, re.M)
+    if not total or not count:
+        return None
+    return float(total.group(1)), float(count.group(1))
+
+
+def report(stats, args, elapsed, connected, server_lag):
+    ms = lambda seconds: f"{seconds * 1000:.1f} ms"
+    total_errors = sum(stats.errors.values())
+    attempts = stats.sent + stats.syncs + stats.reads + stats.uploads + args.clients
+
+    print("\n--- Load Test Report ---")
+    print(f"Clients connected:  {connected}/{args.clients}")
+    print(f"Duration:           {elapsed:.1f} s")
+    print(f"Messages sent:      {stats.sent} ({stats.sent / elapsed:.0f}/s)")
+    print(f"Messages delivered: {stats.delivered} ({stats.delivered / max(stats.sent, 1):.1%}), redeliveries: {stats.duplicates}")
+    print(f"Status events:      {stats.statuses}, read receipts: {stats.reads}, syncs: {stats.syncs}")
+    if stats.uploads:
+        print("Uploads:            {} ({} deduplicated)  p50 {}  p99 {}".format(
+            stats.uploads, stats.deduplicated,
+            ms(percentile(stats.upload_latencies, 50)),
+            ms(percentile(stats.upload_latencies, 99))
+        ))
+    print("Delivery latency:   p50 {}  p90 {}  p99 {}  max {}".format(
+        ms(percentile(stats.latencies, 50)),
+        ms(percentile(stats.latencies, 90)),
+        ms(percentile(stats.latencies, 99)),
+        ms(max(stats.latencies) if stats.latencies else float("nan"))
+    ))
+    print("Generator loop lag: p99 {}  max {}".format(
+        ms(percentile(stats.loop_lag, 99)),
+        ms(max(stats.loop_lag) if stats.loop_lag else float("nan"))
+    ))
+    if server_lag:
+        print(f"Server loop lag:    mean {ms(server_lag)}")
+    print(f"Errors:             {total_errors} ({total_errors / max(attempts, 1):.2%}) {stats.errors or ''}")
+
+
+async def run(args):
+    server = None
+    url = args.url
+    if not url:
+        upload_dir = tempfile.mkdtemp(prefix="stegapp-load-")
+        server = start_local_server(args.port, upload_dir)
+        url = f"http://127.0.0.1:{args.port}"
+    url = url.rstrip("/")
+
+    stats = Stats()
+    lag_task = asyncio.create_task(monitor_loop_lag(stats))
+    clients = []
+    http = aiohttp.ClientSession()
+    try:
+        await wait_until_up(url)
+        usernames = [f"{args.prefix}{i}" for i in range(args.clients)]
+        print(f"Registering {len(usernames)} users at {url}...")
+        await register_users(url, usernames)
+
+        images = []
+        if args.upload_ratio > 0:
+            print(f"Generating {args.upload_pool} {args.upload_size}px test images...")
+            images = make_images(args.upload_pool, args.upload_size)
+
+        clients = [SimClient(u, stats, args, http, images) for u in usernames]
+        print(f"Connecting {len(clients)} clients over {args.ramp:.0f} s...")
+        batch = max(1, int(len(clients) / max(args.ramp, 0.1) / 10))
+        results = []
+        for i in range(0, len(clients), batch):
+            results += await asyncio.gather(*(c.connect(url) for c in clients[i:i + batch]))
+            await asyncio.sleep(0.1)
+        connected = sum(results)
+        live = [c for c, ok in zip(clients, results) if ok]
+
+        lag_before = await scrape_server_loop_lag(url)
+        print(f"Running traffic for {args.duration} s...")
+        start = time.monotonic()
+        deadline = start + args.duration
+        await asyncio.gather(*(c.run(url, usernames, deadline) for c in live))
+        elapsed = time.monotonic() - start
+        # Give in-flight messages a moment to land before reporting
+        await asyncio.sleep(args.drain)
+        lag_after = await scrape_server_loop_lag(url)
+
+        server_lag = None
+        if lag_before and lag_after and lag_after[1] > lag_before[1]:
+            server_lag = (lag_after[0] - lag_before[0]) / (lag_after[1] - lag_before[1])
+        report(stats, args, elapsed, connected, server_lag)
+    finally:
+        lag_task.cancel()
+        await asyncio.gather(*(c.close() for c in clients))
+        await http.close()
+        if server:
+            server.terminate()
+            server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="StegApp Socket.IO load generator")
+    parser.add_argument("--url", help="Target server (default: start a local server)")
+    parser.add_argument("--port", type=int, default=8765, help="Port for the local server")
+    parser.add_argument("--clients", type=int, default=200, help="Concurrent simulated clients")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of traffic")
+    parser.add_argument("--ramp", type=float, default=5, help="Seconds to spread connections over")
+    parser.add_argument("--rate", type=float, default=0.5, help="Messages per second per client")
+    parser.add_argument("--read-ratio", type=float, default=0.8, help="Fraction of received messages acknowledged as read")
+    parser.add_argument("--sync-interval", type=float, default=10, help="Seconds between sync_messages per client")
+    parser.add_argument("--drain", type=float, default=2, help="Seconds to wait for in-flight messages")
+    parser.add_argument("--prefix", default="load_", help="Username prefix for simulated users")
+    parser.add_argument("--image-url", default="/uploads/load-test.png", help="imageUrl carried by messages sent without an upload")
+    parser.add_argument("--upload-ratio", type=float, default=0.1, help="Fraction of sends that upload an image first (0 disables)")
+    parser.add_argument("--upload-pool", type=int, default=50, help="Distinct images to upload; repeats are deduplicated")
+    parser.add_argument("--upload-size", type=int, default=256, help="Width and height of the generated images")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
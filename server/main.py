@@ -1,52 +1,211 @@
 import os
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 import socketio
+import asyncio
 import shutil
+import hashlib
+import logging
+import random
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
 from pathlib import Path
 
-# --- Configuration ---
-# --- Configuration ---
-# UPLOAD_DIR = "uploads" # Deprecated for Cloud
-# Path(UPLOAD_DIR).mkdir(parents=True, exist_ok=True)
-
 from dotenv import load_dotenv
 load_dotenv()
 
-import cloudinary
-import cloudinary.uploader
+# --- Configuration ---
+# Where uploaded images are stored: "cloudinary" (default) or "local".
+# The local backend writes to UPLOAD_DIR and serves files from /uploads;
+# it is meant for offline development and load testing.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "cloudinary")
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "").rstrip("/")
+# Every upload also gets a small lossy preview (longest edge / JPEG quality)
+# that chat lists and notifications load instead of the lossless original.
+PREVIEW_MAX_EDGE = int(os.getenv("PREVIEW_MAX_EDGE", "320"))
+PREVIEW_QUALITY = int(os.getenv("PREVIEW_QUALITY", "60"))
+
+from metrics import (
+    instrument_event, http_metrics_middleware, render_metrics, monitor_event_loop_lag, MongoCommandMetrics,
+    UPLOAD_BYTES, UPLOAD_LATENCY, CONNECTED_SOCKETS, OFFLINE_QUEUE_DEPTH, WRITE_QUEUE_DEPTH, OUTBOUND_PENDING
+)
 
-# Cloudinary Config
-cloudinary.config(
-  cloud_name = os.getenv("CLOUDINARY_CLOUD_NAME"),
-  api_key = os.getenv("CLOUDINARY_API_KEY"),
-  api_secret = os.getenv("CLOUDINARY_API_SECRET"),
-  secure = True
+# --- Logging ---
+# LOG_LEVEL controls verbosity. Hot paths (per-message relay, receipts) log
+# through log_sampled(): every call at DEBUG, otherwise only a
+# LOG_SAMPLE_RATE fraction at INFO. Message payloads are never logged.
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s %(message)s"
 )
+logger = logging.getLogger("stegapp")
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+
+def log_sampled(msg, *args):
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(msg, *args)
+    elif random.random() < LOG_SAMPLE_RATE:
+        logger.info(msg, *args)
+
+# --- Cloudinary ---
+# Imported and configured on first use (or during warm-up), not at import time.
+_cloudinary_uploader = None
+
+def get_cloudinary_uploader():
+    global _cloudinary_uploader
+    if _cloudinary_uploader is None:
+        import cloudinary
+        import cloudinary.uploader
+        cloudinary.config(
+          cloud_name = os.getenv("CLOUDINARY_CLOUD_NAME"),
+          api_key = os.getenv("CLOUDINARY_API_KEY"),
+          api_secret = os.getenv("CLOUDINARY_API_SECRET"),
+          secure = True
+        )
+        _cloudinary_uploader = cloudinary.uploader
+    return _cloudinary_uploader
 
 # --- MongoDB Setup ---
+# Nothing here touches the network at import time. The client and collection
+# handles are created by init_database() in the lifespan handler, and the
+# ping + index creation runs in the background (warm_up). /readyz reports
+# when warm-up has finished.
+from pymongo import InsertOne, UpdateMany
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
+from write_behind import WriteBehindQueue
+from sequences import SequenceAllocator
+from codec import CODECS, CODEC_JSON, CODEC_MSGPACK, encode_payload, accepts_msgpack
+from backpressure import RateLimiter, OutboundQueues, parse_limit
+from retention import (
+    RETENTION_MODES, ensure_ttl_index, drop_ttl_index, ensure_archive_index, drop_archive_index,
+    backfill_read_at, run_compaction
+)
 from pydantic import BaseModel
 
-uri = os.getenv("MONGODB_URI")
-if not uri:
-    raise ValueError("MONGODB_URI environment variable not set")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "2"))
+
+# --- Message Retention ---
+# Delivered-and-read messages leave the hot collection after
+# MESSAGE_RETENTION_DAYS, either deleted by a TTL index ("ttl") or moved to
+# the compact messages_archive collection by a background job ("archive").
+# Undelivered messages are always kept until delivered.
+RETENTION_MODE = os.getenv("MESSAGE_RETENTION_MODE", "off")
+if RETENTION_MODE not in RETENTION_MODES:
+    raise ValueError(f"MESSAGE_RETENTION_MODE must be one of {RETENTION_MODES}")
+RETENTION_SECONDS = int(float(os.getenv("MESSAGE_RETENTION_DAYS", "30")) * 86400)
+COMPACTION_INTERVAL_SECONDS = int(os.getenv("COMPACTION_INTERVAL_SECONDS", "3600"))
+
+mongo_client = None
+db = None
+users_collection = None
+messages_collection = None
+archive_collection = None
+uploads_collection = None  # Content-hash (SHA-256) -> Cloudinary URL (+ preview URL) index for uploaded images
+message_writes = None
+message_seqs = None
+readiness = {"ready": False, "error": None}
+
+def create_mongo_client():
+    uri = os.getenv("MONGODB_URI")
+    if not uri:
+        raise ValueError("MONGODB_URI environment variable not set")
+
+    if uri.startswith("mongomock://"):
+        # In-memory stand-in for offline load tests (pip install mongomock)
+        import mongomock
+        return mongomock.MongoClient()
+    return MongoClient(
+        uri,
+        server_api=ServerApi('1'),
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        event_listeners=[MongoCommandMetrics()]
+    )
+
+def init_database(client):
+    """
+    Bind the collection handles and the components built on them.
+    """
+    global mongo_client, db, users_collection, messages_collection, archive_collection
+    global uploads_collection, message_writes, message_seqs
+    mongo_client = client
+    db = mongo_client["steg_app_db"]
+    users_collection = db["users"]
+    messages_collection = db["messages"]
+    archive_collection = db["messages_archive"]
+    uploads_collection = db["uploads"]
+
+    # Message writes go through a bounded write-behind queue so the relay path
+    # never waits on Mongo. MESSAGE_DURABILITY=sync restores write-before-relay.
+    message_writes = WriteBehindQueue(
+        messages_collection,
+        durability=os.getenv("MESSAGE_DURABILITY", "batched"),
+        max_pending=int(os.getenv("MESSAGE_WRITE_QUEUE_SIZE", "10000")),
+        batch_size=int(os.getenv("MESSAGE_WRITE_BATCH_SIZE", "500")),
+        flush_interval=float(os.getenv("MESSAGE_FLUSH_INTERVAL_MS", "50")) / 1000,
+        max_retries=int(os.getenv("MESSAGE_WRITE_MAX_RETRIES", "8")),
+        dead_letter_path=os.getenv("MESSAGE_DEAD_LETTER_PATH", "write_dead_letter.jsonl")
+    )
+
+    # Every message gets a per-recipient sequence number ("seq") from an atomic
+    # counter, so delta sync is "everything after seq N" instead of relying on
+    # client clocks.
+    message_seqs = SequenceAllocator(db["counters"], block_size=int(os.getenv("SEQ_BLOCK_SIZE", "100")))
+
+def ensure_indexes():
+    messages_collection.create_index([("recipient", 1), ("seq", 1)])
+    # Small partial index: only undelivered messages, for the offline-queue gauge
+    messages_collection.create_index(
+        "delivered", name="undelivered", partialFilterExpression={"delivered": False}
+    )
+    uploads_collection.create_index("hash", unique=True)
+
+    if RETENTION_MODE == "ttl":
+        ensure_ttl_index(messages_collection, RETENTION_SECONDS)
+    else:
+        drop_ttl_index(messages_collection)
+    if RETENTION_MODE == "archive":
+        ensure_archive_index(messages_collection)
+        archive_collection.create_index([("recipient", 1), ("seq", 1)])
+    else:
+        drop_archive_index(messages_collection)
+    if RETENTION_MODE != "off":
+        updated = backfill_read_at(messages_collection, db["migrations"])
+        if updated:
+            logger.info("Backfilled read_at on %d messages read before retention existed", updated)
 
-# Create a new client and connect to the server
-mongo_client = MongoClient(uri, server_api=ServerApi('1'))
-try:
-    mongo_client.admin.command('ping')
-    print("Pinged your deployment. You successfully connected to MongoDB!")
-except Exception as e:
-    print(f"MongoDB Connection Error: {e}")
+async def warm_up():
+    """
+    Background warm-up: ping Mongo, ensure indexes and load the storage
+    client, retrying with backoff until it succeeds.
+    """
+    delay = 1
+    while True:
+        try:
+            await asyncio.to_thread(mongo_client.admin.command, 'ping')
+            logger.info("Pinged your deployment. You successfully connected to MongoDB!")
+            await asyncio.to_thread(ensure_indexes)
+            if STORAGE_BACKEND == "cloudinary":
+                await asyncio.to_thread(get_cloudinary_uploader)
+            readiness.update(ready=True, error=None)
+            return
+        except Exception as e:
+            readiness["error"] = str(e)
+            logger.error("MongoDB Connection Error: %s (retrying in %ds)", e, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
 
-db = mongo_client["steg_app_db"]
-users_collection = db["users"]
-messages_collection = db["messages"]
+# Uploads are hashed in chunks of this size so large PNGs never sit in memory twice
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 
-from typing import Optional
+from typing import List, Optional
 
 # --- Pydantic Models ---
 class UserRegister(BaseModel):
@@ -57,18 +216,217 @@ class KeyUpload(BaseModel):
     username: str
     public_key: str
 
+class UsernameList(BaseModel):
+    usernames: List[str]
+
+# --- Public Key Cache ---
+# Keys rarely change, so lookups are served from an in-process LRU and only
+# misses go to Mongo. /keys/upload and /register invalidate entries.
+PUBLIC_KEY_CACHE_SIZE = int(os.getenv("PUBLIC_KEY_CACHE_SIZE", "10000"))
+MAX_USERNAME_BATCH = 500
+MAX_READ_BATCH = 500  # messageIds per 'messages_read' event
+public_key_cache = OrderedDict()  # username -> public_key (None = user exists without a key)
+public_key_invalidations = 0  # bumped on every invalidation, see get_public_keys
+
+async def get_public_keys(usernames):
+    """
+    Returns { username: public_key or None } for the users that exist.
+    Cache hits are served from memory; all misses are resolved with one $in
+    query, off the event loop.
+    """
+    found = {}
+    misses = []
+    for username in usernames:
+        if username in public_key_cache:
+            public_key_cache.move_to_end(username)
+            found[username] = public_key_cache[username]
+        else:
+            misses.append(username)
+
+    if misses:
+        invalidations = public_key_invalidations
+        users = await asyncio.to_thread(lambda: list(users_collection.find(
+            {"username": {"$in": misses}},
+            {"_id": 0, "username": 1, "public_key": 1}
+        )))
+        # A key uploaded while the query ran may not be in its result:
+        # answer with it, but don't cache it
+        cacheable = invalidations == public_key_invalidations
+        for user in users:
+            username = user["username"]
+            found[username] = user.get("public_key")
+            if cacheable:
+                public_key_cache[username] = found[username]
+        while len(public_key_cache) > PUBLIC_KEY_CACHE_SIZE:
+            public_key_cache.popitem(last=False)
+
+    return found
+
+def invalidate_public_key(username):
+    global public_key_invalidations
+    public_key_invalidations += 1
+    public_key_cache.pop(username, None)
+
+def make_etag(value):
+    return '"' + hashlib.sha256(value.encode("utf-8")).hexdigest()[:32] + '"'
+
+def etag_matches(request, etag):
+    """
+    True if the request's If-None-Match header covers the given ETag.
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [tag.strip() for tag in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
 # --- Socket.IO Setup ---
 # Async Socket.IO server
 sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*')
 # Wrap with ASGI application
 socket_app = socketio.ASGIApp(sio)
 
+# --- Presence ---
+# Clients subscribe to the contacts they care about; status changes are sent
+# only to those subscribers. Changes are debounced so rapid online/offline
+# flapping collapses into at most one update per user per window.
+PRESENCE_DEBOUNCE_SECONDS = float(os.getenv("PRESENCE_DEBOUNCE_SECONDS", "2.0"))
+# App versions that never send subscribe_presence still get every status
+# change, as before. Set PRESENCE_LEGACY_BROADCAST=0 once they are gone.
+PRESENCE_LEGACY_BROADCAST = os.getenv("PRESENCE_LEGACY_BROADCAST", "1") == "1"
+MAX_PRESENCE_SUBSCRIPTIONS = 1000
+
+presence_subscribers = {}  # username -> set of sids watching that user
+sid_subscriptions = {}     # sid -> set of usernames it watches
+legacy_presence_sids = set()  # connected sids that have not subscribed (get every change)
+presence_status = {}       # username -> last published status (offline users are absent)
+pending_presence = {}      # username -> latest status waiting for the debounce window
+user_sids = {}             # username -> sid of the user's current connection
+sid_usernames = {}         # sid -> username
+sid_codecs = {}            # sid -> payload codec negotiated at connect (absent = JSON)
+presence_flush_task = None
+
+# --- Rate Limits & Backpressure ---
+# Every connection gets a token bucket per event type, so one client cannot
+# flood the shared event loop with database work. Limits are "rate/burst"
+# per second, overridable per event with RATE_LIMIT_<EVENT> (e.g.
+# RATE_LIMIT_SEND_MESSAGE=50/100); "off" disables a limit.
+DEFAULT_RATE_LIMITS = {
+    "send_message": "20/40",
+    "delete_message": "5/20",
+    "sync_messages": "0.5/5",
+    "user_status": "1/5",
+    "subscribe_presence": "0.5/10",
+    "message_read": "20/200",
+    "messages_read": "5/20",
+}
+event_limits = RateLimiter({
+    event: parse_limit(os.getenv(f"RATE_LIMIT_{event.upper()}", default))
+    for event, default in DEFAULT_RATE_LIMITS.items()
+})
+
+# Outbound events to a connection whose transport has more than
+# OUTBOUND_HIGH_WATER packets unsent are queued (at most OUTBOUND_MAX_PENDING),
+# with status events coalesced; see backpressure.OutboundQueues.
+OUTBOUND_HIGH_WATER = int(os.getenv("OUTBOUND_HIGH_WATER", "64"))
+OUTBOUND_MAX_PENDING = int(os.getenv("OUTBOUND_MAX_PENDING", "1000"))
+
+async def send_encoded(sid, event, data):
+    """
+    Emit to one connection in the payload codec it negotiated at connect.
+    """
+    if sid_codecs.get(sid) == CODEC_MSGPACK:
+        data = encode_payload(event, data)
+    await sio.emit(event, data, room=sid)
+
+def transport_backlog(sid):
+    """
+    Packets queued in Engine.IO for this connection but not yet written.
+    """
+    eio_sid = sio.manager.eio_sid_from_sid(sid, '/')
+    socket = sio.eio.sockets.get(eio_sid) if eio_sid else None
+    return socket.queue.qsize() if socket else 0
+
+outbound = OutboundQueues(
+    send_encoded, transport_backlog, sio.disconnect,
+    high_water=OUTBOUND_HIGH_WATER, max_pending=OUTBOUND_MAX_PENDING
+)
+
+async def emit_to(sid, event, data, block=False):
+    """
+    Emit to one connection, through its bounded outbound queue.
+    """
+    await outbound.put(sid, event, data, block=block)
+
+def set_presence(username, status):
+    """
+    Queue a status change; it is published after the debounce window.
+    """
+    global presence_flush_task
+    pending_presence[username] = status
+    if presence_flush_task is None or presence_flush_task.done():
+        presence_flush_task = asyncio.create_task(flush_presence())
+
+async def flush_presence():
+    """
+    Publish coalesced status changes to subscribers only.
+    Toggles that end where they started within a window are dropped.
+    """
+    while pending_presence:
+        await asyncio.sleep(PRESENCE_DEBOUNCE_SECONDS)
+        updates = dict(pending_presence)
+        pending_presence.clear()
+
+        for username, status in updates.items():
+            if presence_status.get(username, 'offline') == status:
+                continue
+            if status == 'offline':
+                presence_status.pop(username, None)
+            else:
+                presence_status[username] = status
+
+            targets = presence_subscribers.get(username, set()) | legacy_presence_sids
+            for target_sid in list(targets):
+                await emit_to(target_sid, 'user_status', {'username': username, 'status': status})
+
+def unsubscribe_presence(sid):
+    for username in sid_subscriptions.pop(sid, ()):
+        subscribers = presence_subscribers.get(username)
+        if subscribers is not None:
+            subscribers.discard(sid)
+            if not subscribers:
+                del presence_subscribers[username]
+
 # --- FastAPI Setup ---
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    # SRV lookups happen while the client is constructed; keep them off the loop
+    init_database(await asyncio.to_thread(create_mongo_client))
+    warm_up_task = asyncio.create_task(warm_up())
+    lag_monitor = asyncio.create_task(monitor_event_loop_lag())
+    message_writes.start()
+    compaction = None
+    if RETENTION_MODE == "archive":
+        compaction = asyncio.create_task(run_compaction(
+            messages_collection, archive_collection, RETENTION_SECONDS, COMPACTION_INTERVAL_SECONDS
+        ))
+    yield
+    if compaction:
+        compaction.cancel()
+    await message_writes.stop()
+    lag_monitor.cancel()
+    warm_up_task.cancel()
+    mongo_client.close()
+
+app = FastAPI(lifespan=lifespan)
 
 # Mount Socket.IO app to /socket.io
 app.mount("/socket.io", socket_app)
 
+if STORAGE_BACKEND == "local":
+    Path(UPLOAD_DIR).mkdir(parents=True, exist_ok=True)
+    app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+
 # CORS (Allow all for development)
 app.add_middleware(
     CORSMiddleware,
@@ -78,10 +436,42 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route request counters and latency histograms
+app.middleware("http")(http_metrics_middleware)
+
 @app.get("/")
 async def root():
     return {"status": "running", "message": "StegApp Cloud Server is Active"}
 
+@app.get("/healthz")
+async def healthz():
+    """
+    Liveness: the process is up and serving requests.
+    """
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """
+    Readiness: Mongo answered a ping and indexes are in place.
+    """
+    if readiness["ready"]:
+        return {"status": "ready"}
+    return JSONResponse(status_code=503, content={"status": "starting", "error": readiness["error"]})
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus scrape endpoint.
+    """
+    OFFLINE_QUEUE_DEPTH.set(await asyncio.to_thread(
+        messages_collection.count_documents, {"delivered": False}
+    ))
+    WRITE_QUEUE_DEPTH.set(len(message_writes))
+    OUTBOUND_PENDING.set(len(outbound))
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
 @app.post("/register")
 async def register(user: UserRegister):
     """
@@ -96,6 +486,7 @@ async def register(user: UserRegister):
         "socket_id": None,
         "public_key": user.public_key
     })
+    invalidate_public_key(user.username)
     return {"status": "success", "username": user.username}
 
 @app.get("/check_user/{username}")
@@ -103,11 +494,31 @@ async def check_user(username: str):
     """
     Checks if a user exists.
     """
-    user = users_collection.find_one({"username": username})
-    if user:
+    if username in await get_public_keys([username]):
         return {"exists": True}
     return {"exists": False}
 
+@app.post("/check_users")
+async def check_users(data: UsernameList):
+    """
+    Bulk contact discovery: which of these usernames exist, with their
+    public keys and presence, in one round trip.
+    Lookups go through the public-key cache, so unknown names cost one
+    projected $in query in total. Clients can call this incrementally
+    with only the contacts added since the last sync.
+    """
+    usernames = list(dict.fromkeys(u for u in data.usernames if u))
+    if len(usernames) > MAX_USERNAME_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_USERNAME_BATCH} usernames per request")
+
+    found = await get_public_keys(usernames)
+    users = {
+        u: {"public_key": found[u], "status": presence_status.get(u, 'offline')}
+        for u in usernames if u in found
+    }
+    missing = [u for u in usernames if u not in found]
+    return {"users": users, "missing": missing}
+
 @app.post("/keys/upload")
 async def upload_key(data: KeyUpload):
     """
@@ -119,104 +530,297 @@ async def upload_key(data: KeyUpload):
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
+    invalidate_public_key(data.username)
     return {"status": "success"}
 
 @app.get("/keys/fetch/{username}")
-async def fetch_key(username: str):
+async def fetch_key(username: str, request: Request, response: Response):
     """
     Retrieves the public key for a specific user.
+    Supports If-None-Match: an unchanged key returns 304 with no body.
     """
-    user = users_collection.find_one({"username": username})
-    if not user:
+    keys = await get_public_keys([username])
+    if username not in keys:
         raise HTTPException(status_code=404, detail="User not found")
     
-    public_key = user.get("public_key")
+    public_key = keys[username]
     if not public_key:
         raise HTTPException(status_code=404, detail="User has no public key")
-        
+
+    etag = make_etag(public_key)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    response.headers.update(headers)
     return {"username": username, "public_key": public_key}
 
+@app.post("/keys/fetch_many")
+async def fetch_keys_many(data: UsernameList, request: Request, response: Response):
+    """
+    Retrieves public keys for a whole contact list in one call.
+    Users that do not exist or have no key are listed in "missing".
+    Supports If-None-Match over the full result.
+    """
+    usernames = list(dict.fromkeys(u for u in data.usernames if u))
+    if len(usernames) > MAX_USERNAME_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_USERNAME_BATCH} usernames per request")
+
+    found = await get_public_keys(usernames)
+    keys = {u: found[u] for u in usernames if found.get(u)}
+    missing = [u for u in usernames if not found.get(u)]
+
+    etag = make_etag("\n".join(f"{u}:{keys[u]}" for u in sorted(keys)) + "|" + ",".join(sorted(missing)))
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    response.headers.update(headers)
+    return {"keys": keys, "missing": missing}
+
+def store_image(fileobj, content_hash):
+    """
+    Persists an uploaded PNG with the configured storage backend.
+    Returns the public URL.
+    """
+    if STORAGE_BACKEND == "local":
+        path = Path(UPLOAD_DIR) / f"{content_hash}.png"
+        with open(path, "wb") as out:
+            shutil.copyfileobj(fileobj, out)
+        return f"{PUBLIC_BASE_URL}/uploads/{content_hash}.png"
+
+    # Upload to Cloudinary (Enforce PNG and Lossless via quality)
+    # Increased timeout to 300s for large files
+    # public_id = content hash, so concurrent duplicate uploads land on the same asset
+    result = get_cloudinary_uploader().upload(
+        fileobj,
+        resource_type="image",
+        format="png",
+        quality="100",
+        public_id=content_hash,
+        overwrite=False,
+        timeout=300
+    )
+    return result.get("secure_url")
+
+def store_preview(content_hash):
+    """
+    Creates the lossy preview of a stored upload. Returns its URL, or None
+    if no preview can be made. The hidden payload only survives in the
+    lossless original, so the preview reveals nothing beyond the cover image.
+    """
+    if STORAGE_BACKEND == "local":
+        try:
+            from PIL import Image
+        except ImportError:
+            logger.warning("Pillow not installed, uploads get no preview")
+            return None
+        source = Path(UPLOAD_DIR) / f"{content_hash}.png"
+        target = Path(UPLOAD_DIR) / f"{content_hash}.preview.jpg"
+        with Image.open(source) as img:
+            img.thumbnail((PREVIEW_MAX_EDGE, PREVIEW_MAX_EDGE))
+            img.convert("RGB").save(target, "JPEG", quality=PREVIEW_QUALITY, optimize=True)
+        return f"{PUBLIC_BASE_URL}/uploads/{target.name}"
+
+    # Cloudinary derives the preview from the original on first request
+    get_cloudinary_uploader()
+    from cloudinary.utils import cloudinary_url
+    url, _ = cloudinary_url(
+        content_hash,
+        width=PREVIEW_MAX_EDGE,
+        height=PREVIEW_MAX_EDGE,
+        crop="limit",
+        quality=PREVIEW_QUALITY,
+        format="jpg",
+        secure=True
+    )
+    return url
+
+@app.get("/upload/exists/{content_hash}")
+async def upload_exists(content_hash: str):
+    """
+    Checks if an image with the given SHA-256 hash was already uploaded.
+    Clients call this before sending any bytes and reuse the returned URL.
+    """
+    entry = await asyncio.to_thread(
+        uploads_collection.find_one, {"hash": content_hash.lower()}, {"_id": 0, "url": 1, "preview_url": 1}
+    )
+    if entry:
+        return {"exists": True, "url": entry["url"], "previewUrl": entry.get("preview_url")}
+    return {"exists": False}
+
 @app.post("/upload/")
 async def upload_image(file: UploadFile = File(...)):
     """
-    Receives an image file and uploads it to Cloudinary.
-    Returns the secure URL.
+    Receives an image file and stores it (Cloudinary by default).
+    Identical images (same SHA-256) are uploaded only once; duplicates
+    return the stored URL without touching Cloudinary.
+    Returns the secure URL of the lossless original and a previewUrl for
+    a small lossy preview (null if none could be made).
     """
+    start = time.perf_counter()
     try:
-        # Upload to Cloudinary (Enforce PNG and Lossless via quality)
-        # Increased timeout to 300s for large files
-        print(f"Starting upload for {file.filename}...")
-        result = cloudinary.uploader.upload(
-            file.file, 
-            resource_type="image",
-            format="png",
-            quality="100",
-            timeout=300 
+        # Hash the upload chunk by chunk as it is read from the spooled file
+        hasher = hashlib.sha256()
+        size = 0
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+            size += len(chunk)
+        content_hash = hasher.hexdigest()
+
+        # Storage and Mongo calls block: keep them off the event loop
+        existing = await asyncio.to_thread(
+            uploads_collection.find_one, {"hash": content_hash}, {"_id": 0, "url": 1, "preview_url": 1}
         )
-        # Get the URL
-        url = result.get("secure_url")
-        print(f"Upload success: {url}")
-        return {"status": "success", "url": url, "filename": file.filename}
+        if existing:
+            logger.info("Upload deduplicated: %s (%s)", file.filename, content_hash[:12])
+            UPLOAD_BYTES.labels("true").inc(size)
+            UPLOAD_LATENCY.labels("true").observe(time.perf_counter() - start)
+            return {
+                "status": "success",
+                "url": existing["url"],
+                "previewUrl": existing.get("preview_url"),
+                "filename": file.filename,
+                "hash": content_hash,
+                "deduplicated": True
+            }
+
+        await file.seek(0)
+        logger.info("Starting upload for %s (%d bytes)...", file.filename, size)
+        url = await asyncio.to_thread(store_image, file.file, content_hash)
+        try:
+            preview_url = await asyncio.to_thread(store_preview, content_hash)
+        except Exception as e:
+            # A missing preview only costs bandwidth; never fail the upload for it
+            logger.warning("Preview failed for %s: %s", content_hash[:12], e)
+            preview_url = None
+        await asyncio.to_thread(
+            uploads_collection.update_one,
+            {"hash": content_hash},
+            {"$setOnInsert": {
+                "hash": content_hash, "url": url, "preview_url": preview_url,
+                "size": size, "created_at": int(time.time() * 1000)
+            }},
+            upsert=True
+        )
+        logger.info("Upload success: %s", url)
+        UPLOAD_BYTES.labels("false").inc(size)
+        UPLOAD_LATENCY.labels("false").observe(time.perf_counter() - start)
+        return {
+            "status": "success",
+            "url": url,
+            "previewUrl": preview_url,
+            "filename": file.filename,
+            "hash": content_hash,
+            "deduplicated": False
+        }
     except Exception as e:
-        print(f"Upload Error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Upload Error: %s", e)
         raise HTTPException(status_code=500, detail=f"Upload Failed: {str(e)}")
 
 # --- Socket.IO Events ---
+def message_payload(msg):
+    """
+    Stored message document -> 'new_message' event payload.
+    """
+    return {
+        "id": msg.get("id"),
+        "text": msg.get("text"),
+        "imageUrl": msg.get("imageUrl"),
+        "previewUrl": msg.get("previewUrl"),
+        "sender": msg.get("sender"),
+        "recipient": msg.get("recipient"),
+        "camouflageText": msg.get("camouflageText"),
+        "timestamp": msg.get("timestamp"),
+        "replyToId": msg.get("replyToId"),
+        "seq": msg.get("seq")
+    }
+
 @sio.event
+@instrument_event
 async def connect(sid, environ):
     # Extract username from query params
     query_string = environ.get('QUERY_STRING', '')
     params = dict(qs.split('=') for qs in query_string.split('&') if '=' in qs)
     username = params.get('username')
+    CONNECTED_SOCKETS.inc()
+
+    # Opt-in binary payloads: ?codec=msgpack (default JSON for older clients)
+    codec = params.get('codec', CODEC_JSON)
+    if codec == CODEC_MSGPACK:
+        sid_codecs[sid] = codec
+    elif codec not in CODECS:
+        logger.warning("Unknown codec %r from %s, using JSON", codec, sid)
+
+    # Until it subscribes, a connection is treated as an older client
+    if PRESENCE_LEGACY_BROADCAST:
+        legacy_presence_sids.add(sid)
     
     if username:
-        print(f"Client connected: {username} ({sid})")
+        logger.info("Client connected: %s (%s)", username, sid)
         users_collection.update_one({"username": username}, {"$set": {"socket_id": sid}})
+        user_sids[username] = sid
+        sid_usernames[sid] = username
+        set_presence(username, 'online')
         
-        # SYNC: Deliver offline messages
-        offline_msgs = messages_collection.find({"recipient": username, "delivered": False})
+        # SYNC: Deliver offline messages (flush first so just-queued ones are visible)
+        await message_writes.flush()
+        offline_msgs = messages_collection.find({"recipient": username, "delivered": False}).sort("seq", 1)
+        delivered_ids = []
         for msg in offline_msgs:
-            data = {
-                "id": msg.get("id"),
-                "text": msg.get("text"),
-                "imageUrl": msg.get("imageUrl"),
-                "sender": msg.get("sender"),
-                "recipient": msg.get("recipient"),
-                "timestamp": msg.get("timestamp")
-            }
-            await sio.emit('new_message', data, room=sid)
-            # Mark as delivered
-            messages_collection.update_one({"_id": msg["_id"]}, {"$set": {"delivered": True}})
-            print(f"Synced offline message from {data['sender']} to {username}")
+            data = message_payload(msg)
+            await emit_to(sid, 'new_message', data, block=True)
+            delivered_ids.append(msg["_id"])
+            log_sampled("Synced offline message from %s to %s", data['sender'], username)
             
             # ✅ Send delivery confirmation to sender
-            sender_user = users_collection.find_one({"username": data['sender']})
-            if sender_user and sender_user.get("socket_id"):
-                await sio.emit('message_status', {
+            sender_sid = user_sids.get(data['sender'])
+            if sender_sid:
+                await emit_to(sender_sid, 'message_status', {
                     'messageId': data['id'],
                     'status': 'delivered'
-                }, room=sender_user["socket_id"])
-                print(f"✅ Sent 'delivered' status to {data['sender']} for offline message")
+                })
+                log_sampled("✅ Sent 'delivered' status to %s for offline message", data['sender'])
 
+        # Mark all replayed messages as delivered in one write
+        if delivered_ids:
+            await message_writes.put(UpdateMany({"_id": {"$in": delivered_ids}}, {"$set": {"delivered": True}}))
 
     else:
-        print(f"Client connected (Anonymous): {sid}")
+        logger.info("Client connected (Anonymous): %s", sid)
 
 @sio.event
+@instrument_event
 async def disconnect(sid):
-    print(f"Client disconnected: {sid}")
+    logger.info("Client disconnected: %s", sid)
+    CONNECTED_SOCKETS.dec()
     # Optional: Clear socket_id in DB
     users_collection.update_one({"socket_id": sid}, {"$set": {"socket_id": None}})
 
+    unsubscribe_presence(sid)
+    legacy_presence_sids.discard(sid)
+    outbound.discard(sid)
+    event_limits.discard(sid)
+    sid_codecs.pop(sid, None)
+    username = sid_usernames.pop(sid, None)
+    # Only go offline if the user has not already reconnected on a new socket
+    if username and user_sids.get(username) == sid:
+        del user_sids[username]
+        set_presence(username, 'offline')
+
 @sio.event
+@instrument_event
+@event_limits.limit
+@accepts_msgpack
 async def delete_message(sid, data):
     """
     Handle message deletion request.
     Data: { 'messageId': ..., 'recipient': ... }
     """
-    print(f"Delete request received: {data}")
+    logger.info("Delete request received for message %s", data.get('messageId'))
     recipient = data.get('recipient')
     message_id = data.get('messageId')
 
@@ -225,146 +829,213 @@ async def delete_message(sid, data):
         # messages_collection.delete_one({"_id": ...}) # ID format mismatch likely, skipping for now or use filter
         
         # 2. Forward to Recipient
-        user = users_collection.find_one({"username": recipient})
-        if user and user.get("socket_id"):
-            target_sid = user["socket_id"]
-            await sio.emit('delete_message', data, room=target_sid)
-            print(f"Forwarded delete_message to {recipient}")
+        target_sid = user_sids.get(recipient)
+        if target_sid:
+            await emit_to(target_sid, 'delete_message', data)
+            logger.info("Forwarded delete_message to %s", recipient)
         else:
-            print(f"Recipient {recipient} offline. Deletion not propagated immediately.")
+            logger.info("Recipient %s offline. Deletion not propagated immediately.", recipient)
     else:
-        print(f"Invalid delete request: {data}")
+        logger.warning("Invalid delete request from %s", sid)
 
 
-print("✅ Socket.IO event handlers registered: connect, disconnect, send_message, delete_message, user_status, message_read")
+logger.info("✅ Socket.IO event handlers registered: connect, disconnect, send_message, delete_message, user_status, subscribe_presence, message_read, messages_read")
 
 
 @sio.event
+@instrument_event
+@event_limits.limit
+@accepts_msgpack
 async def sync_messages(sid, data):
     """
     Handle sync request from client.
-    Data: { 'username': ..., 'lastTimestamp': ... }
+    Data: { 'username': ..., 'lastSeq': ... }
+    Sends every message for this user with seq > lastSeq, in seq order,
+    and acks with { 'count': ..., 'lastSeq': ... }.
+    Older clients that send 'lastTimestamp' instead still get the
+    timestamp-based query.
     """
     username = data.get('username')
-    last_timestamp = data.get('lastTimestamp', 0)
+    use_seq = data.get('lastSeq') is not None
+    last_value = data.get('lastSeq') if use_seq else data.get('lastTimestamp', 0)
     
-    # Ensure timestamp is treated as int/long
+    # Ensure seq/timestamp is treated as int/long
     try:
-        last_timestamp = int(last_timestamp)
-    except:
-        last_timestamp = 0
+        last_value = int(last_value)
+    except (TypeError, ValueError):
+        last_value = 0
         
-    print(f"🔄 Sync request from {username} (Last: {last_timestamp})")
+    logger.info("🔄 Sync request from %s (Last %s: %s)", username, "seq" if use_seq else "timestamp", last_value)
     
-    # Query: Recipient == username, Timestamp > last_timestamp
+    # Query: Recipient == username, seq (or timestamp) > last value
+    field = "seq" if use_seq else "timestamp"
     query = {
         "recipient": username,
-        "timestamp": {"$gt": last_timestamp}
+        field: {"$gt": last_value}
     }
     
     # Use sort to send in order
-    cursor = messages_collection.find(query).sort("timestamp", 1)
+    await message_writes.flush()
+    cursor = messages_collection.find(query).sort(field, 1)
     
     count = 0
-    # Async iteration over cursor
-    async for msg in cursor:
-        msg_data = {
-            "id": msg.get("id"),
-            "text": msg.get("text"),
-            "imageUrl": msg.get("imageUrl"),
-            "sender": msg.get("sender"),
-            "recipient": msg.get("recipient"),
-            "camouflageText": msg.get("camouflageText"),
-            "timestamp": msg.get("timestamp"),
-            "replyToId": msg.get("replyToId")
-        }
-        await sio.emit('new_message', msg_data, room=sid)
+    delivered_ids = []
+    last_seq = last_value if use_seq else 0
+    for msg in cursor:
+        msg_data = message_payload(msg)
+        await emit_to(sid, 'new_message', msg_data, block=True)
+        last_seq = max(last_seq, msg.get("seq") or 0)
         
         # Mark as delivered since we just synced it
-        messages_collection.update_one({"_id": msg["_id"]}, {"$set": {"delivered": True}})
+        if not msg.get("delivered"):
+            delivered_ids.append(msg["_id"])
         
-        # Notify Sender
-        sender = msg.get("sender")
-        sender_user = users_collection.find_one({"username": sender})
-        if sender_user and sender_user.get("socket_id"):
-             await sio.emit('message_status', {
+        # Notify Sender (a message already read stays 'read' for them)
+        sender_sid = user_sids.get(msg.get("sender"))
+        if sender_sid and not msg.get("read"):
+             await emit_to(sender_sid, 'message_status', {
                 'messageId': msg.get("id"),
                 'status': 'delivered'
-            }, room=sender_user["socket_id"])
+            })
             
         count += 1
+
+    if delivered_ids:
+        await message_writes.put(UpdateMany({"_id": {"$in": delivered_ids}}, {"$set": {"delivered": True}}))
         
-    print(f"✅ Synced {count} missed messages to {username}")
+    logger.info("✅ Synced %d missed messages to %s", count, username)
+    return {"count": count, "lastSeq": last_seq}
 
 @sio.event
+@instrument_event
+@event_limits.limit
+@accepts_msgpack
 async def user_status(sid, data):
     """
     Handle user online/offline status updates.
     Data: { 'username': ..., 'status': 'online'/'offline' }
+    Only subscribers of this user receive the (debounced) update.
     """
     username = data.get('username')
     status = data.get('status')
     
     if username and status:
-        print(f"User {username} is now {status}")
-        # Broadcast to all connected clients
-        await sio.emit('user_status', data, skip_sid=sid)
+        log_sampled("User %s is now %s", username, status)
+        set_presence(username, status)
     else:
-        print(f"Invalid status update: {data}")
+        logger.warning("Invalid status update from %s", sid)
+
+@sio.event
+@instrument_event
+@event_limits.limit
+@accepts_msgpack
+async def subscribe_presence(sid, data):
+    """
+    Subscribe this connection to status updates for a list of contacts.
+    Data: { 'usernames': [...] }  (replaces any previous subscription)
+    Acks with the current status of each contact.
+    """
+    usernames = {u for u in (data.get('usernames') or []) if u}
+    if len(usernames) > MAX_PRESENCE_SUBSCRIPTIONS:
+        logger.warning("Presence subscription from %s too large (%d), truncating", sid, len(usernames))
+        usernames = set(list(usernames)[:MAX_PRESENCE_SUBSCRIPTIONS])
+
+    unsubscribe_presence(sid)
+    legacy_presence_sids.discard(sid)
+    sid_subscriptions[sid] = usernames
+    for username in usernames:
+        presence_subscribers.setdefault(username, set()).add(sid)
+
+    return {username: presence_status.get(username, 'offline') for username in usernames}
 
 
 
 @sio.event
+@instrument_event
+@event_limits.limit
+@accepts_msgpack
 async def send_message(sid, data):
     """
     Relay message to specific recipient if possible, else broadcast.
-    Data: { 'text': ..., 'imageUrl': ..., 'sender': ..., 'recipient': ... }
+    Data: { 'text': ..., 'imageUrl': ..., 'previewUrl': ..., 'sender': ..., 'recipient': ... }
+    Presence is resolved from memory and the message is emitted before it
+    is persisted (unless MESSAGE_DURABILITY=sync); the insert, already
+    carrying the final 'delivered' flag, goes through the write-behind queue.
     """
-    print(f"Message received: {data}")
+    log_sampled("Message %s received from %s for %s", data.get('id'), data.get('sender'), data.get('recipient'))
     recipient = data.get('recipient')
     sender = data.get('sender')
     message_id = data.get('id')
+    seq = await message_seqs.next(recipient) if recipient else None
+    target_sid = user_sids.get(recipient) if recipient else None
     
-    # ALWAYS Save to DB first (Persistence)
     msg_doc = {
         "id": message_id,
         "text": data.get("text"),
         "imageUrl": data.get("imageUrl"),
+        "previewUrl": data.get("previewUrl"),
         "sender": sender,
         "recipient": recipient,
+        "camouflageText": data.get("camouflageText"),
+        "replyToId": data.get("replyToId"),
         "timestamp": data.get("timestamp"), # Client should send TS or Server adds it
-        "delivered": False,
+        "seq": seq,
+        "delivered": target_sid is not None,
         "read": False
     }
-    result = messages_collection.insert_one(msg_doc)
+    # Non-blocking in batched mode; writes through before relaying in sync mode
+    await message_writes.put(InsertOne(msg_doc))
     
     if recipient:
-        # Find recipient's socket_id
-        user = users_collection.find_one({"username": recipient})
-        if user and user.get("socket_id"):
-            target_sid = user["socket_id"]
-            # Try to emit
-            await sio.emit('new_message', data, room=target_sid)
-            print(f"Sent to {recipient} at {target_sid}")
-            # Mark as delivered in DB
-            messages_collection.update_one({"_id": result.inserted_id}, {"$set": {"delivered": True}})
+        if target_sid:
+            await emit_to(target_sid, 'new_message', {**data, "seq": seq})
+            log_sampled("Sent to %s at %s", recipient, target_sid)
             
             # ✅ SEND DELIVERY CONFIRMATION TO SENDER
-            sender_user = users_collection.find_one({"username": sender})
-            if sender_user and sender_user.get("socket_id"):
-                await sio.emit('message_status', {
-                    'messageId': message_id,
-                    'status': 'delivered'
-                }, room=sender_user["socket_id"])
-                print(f"✅ Sent 'delivered' status to {sender}")
+            await emit_to(sid, 'message_status', {
+                'messageId': message_id,
+                'status': 'delivered'
+            })
+            log_sampled("✅ Sent 'delivered' status to %s", sender)
         else:
-            print(f"Recipient {recipient} offline. Message queued.")
+            log_sampled("Recipient %s offline. Message queued.", recipient)
     else:
         # Fallback to broadcast (Old behavior - rarely used now)
         await sio.emit('new_message', data)
 
 
+# --- Read Receipts ---
+# Older apps send one 'message_read' per unread message when a chat opens.
+# Receipts over the rate limit are not dropped: their ids are folded into
+# one batch per connection and applied after READ_DEFER_SECONDS.
+READ_DEFER_SECONDS = float(os.getenv("READ_DEFER_SECONDS", "1.0"))
+MAX_DEFERRED_READS = 10 * MAX_READ_BATCH  # per connection and window
+deferred_reads = {}  # sid -> message ids waiting to be applied
+
+async def defer_read_receipt(sid, data):
+    message_id = data.get('messageId') if isinstance(data, dict) else None
+    if not message_id:
+        return
+    pending = deferred_reads.get(sid)
+    if pending is None:
+        pending = deferred_reads[sid] = []
+        asyncio.create_task(flush_deferred_reads(sid))
+    if len(pending) < MAX_DEFERRED_READS:
+        pending.append(message_id)
+
+async def flush_deferred_reads(sid):
+    await asyncio.sleep(READ_DEFER_SECONDS)
+    message_ids = list(dict.fromkeys(deferred_reads.pop(sid, [])))
+    for i in range(0, len(message_ids), MAX_READ_BATCH):
+        try:
+            await apply_read_receipts(message_ids[i:i + MAX_READ_BATCH], batched=False)
+        except Exception as e:
+            logger.exception("Deferred read receipts for %s failed: %s", sid, e)
+
 @sio.event
+@instrument_event
+@accepts_msgpack  # above the limiter, so defer_read_receipt gets decoded data too
+@event_limits.limit(overflow=defer_read_receipt)
 async def message_read(sid, data):
     """
     Handle read receipt from recipient.
@@ -373,31 +1044,116 @@ async def message_read(sid, data):
     message_id = data.get('messageId')
     reader = data.get('reader')
     
-    print(f"👁️ Read receipt: {reader} read message {message_id}")
+    log_sampled("👁️ Read receipt: %s read message %s", reader, message_id)
     
-    # Update DB to mark as read
-    messages_collection.update_one(
-        {"id": message_id},
-        {"$set": {"read": True}}
-    )
+    # Mark as read (queued behind the message's own insert)
+    await message_writes.put(UpdateMany(
+        {"id": message_id, "read": {"$ne": True}},
+        {"$set": {"read": True, "read_at": datetime.now(timezone.utc)}}
+    ))
     
     # Find the original message to get sender
-    msg = messages_collection.find_one({"id": message_id})
+    projection = {"_id": 0, "sender": 1}
+    msg = messages_collection.find_one({"id": message_id}, projection)
+    if not msg and len(message_writes):
+        # The message may still be waiting in the write-behind queue
+        await message_writes.flush()
+        msg = messages_collection.find_one({"id": message_id}, projection)
     if msg:
         sender = msg.get("sender")
         
         # Send read status to original sender
-        sender_user = users_collection.find_one({"username": sender})
-        if sender_user and sender_user.get("socket_id"):
-            await sio.emit('message_status', {
+        sender_sid = user_sids.get(sender)
+        if sender_sid:
+            await emit_to(sender_sid, 'message_status', {
                 'messageId': message_id,
                 'status': 'read'
-            }, room=sender_user["socket_id"])
-            print(f"✅ Sent 'read' status to {sender}")
+            })
+            log_sampled("✅ Sent 'read' status to %s", sender)
         else:
-            print(f"⚠️ Sender {sender} offline, read receipt not sent")
+            log_sampled("⚠️ Sender %s offline, read receipt not sent", sender)
     else:
-        print(f"⚠️ Message {message_id} not found in database")
+        logger.warning("⚠️ Message %s not found in database", message_id)
+
+
+
+@sio.event
+@instrument_event
+@event_limits.limit
+@accepts_msgpack
+async def messages_read(sid, data):
+    """
+    Handle a batch of read receipts from recipient (e.g. opening a chat).
+    Data: { 'messageIds': [...], 'reader': ... }
+    One update_many, one sender lookup and one 'message_status_batch'
+    emit per online sender, regardless of batch size.
+    At most MAX_READ_BATCH ids per event; larger batches are rejected.
+    """
+    message_ids = list(dict.fromkeys(m for m in (data.get('messageIds') or []) if m))
+    reader = data.get('reader')
+
+    if not message_ids:
+        logger.warning("Invalid batched read receipt from %s", sid)
+        return
+    if len(message_ids) > MAX_READ_BATCH:
+        logger.warning("Batched read receipt from %s too large (%d ids)", sid, len(message_ids))
+        return {"error": f"At most {MAX_READ_BATCH} messageIds per event"}
+
+    log_sampled("👁️ Batched read receipt: %s read %d messages", reader, len(message_ids))
+    await apply_read_receipts(message_ids)
+
+
+async def apply_read_receipts(message_ids, batched=True):
+    """
+    Mark messages read and notify their senders with one
+    'message_status_batch' per online sender, or (batched=False, for
+    receipts from older apps) one 'message_status' per message.
+    """
+    await message_writes.put(UpdateMany(
+        {"id": {"$in": message_ids}, "read": {"$ne": True}},
+        {"$set": {"read": True, "read_at": datetime.now(timezone.utc)}}
+    ))
+
+    # Group the message ids by their original sender
+    query = {"id": {"$in": message_ids}}
+    projection = {"_id": 0, "id": 1, "sender": 1}
+    found = list(messages_collection.find(query, projection))
+    if len(found) < len(message_ids) and len(message_writes):
+        # Some of the messages may still be waiting in the write-behind queue
+        await message_writes.flush()
+        found = list(messages_collection.find(query, projection))
+
+    ids_by_sender = {}
+    for msg in found:
+        ids_by_sender.setdefault(msg.get("sender"), []).append(msg.get("id"))
+
+    if batched:
+        await emit_status_batches(ids_by_sender, 'read')
+        return
+    for sender, ids in ids_by_sender.items():
+        sender_sid = user_sids.get(sender)
+        if sender_sid:
+            for message_id in ids:
+                await emit_to(sender_sid, 'message_status', {'messageId': message_id, 'status': 'read'})
+
+
+async def emit_status_batches(ids_by_sender, status):
+    """
+    Send one coalesced 'message_status_batch' event per online sender.
+    ids_by_sender: { sender_username: [messageId, ...] }
+    """
+    if not ids_by_sender:
+        return
+
+    for sender, message_ids in ids_by_sender.items():
+        sender_sid = user_sids.get(sender)
+        if not sender_sid:
+            continue
+        await emit_to(sender_sid, 'message_status_batch', {
+            'messageIds': message_ids,
+            'status': status
+        })
+        log_sampled("✅ Sent '%s' status for %d messages to %s", status, len(message_ids), sender)
 
 
 
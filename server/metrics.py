@@ -0,0 +1,196 @@
+import asyncio
+import functools
+import inspect
+import time
+
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+from pymongo import monitoring
+
+# --- Metric Definitions ---
+SOCKET_EVENTS = Counter(
+    "stegapp_socket_events_total",
+    "Socket.IO events handled, by event name and outcome",
+    ["event", "outcome"]
+)
+SOCKET_EVENT_LATENCY = Histogram(
+    "stegapp_socket_event_seconds",
+    "Socket.IO event handler latency",
+    ["event"]
+)
+HTTP_REQUESTS = Counter(
+    "stegapp_http_requests_total",
+    "REST requests handled, by route template, method and status code",
+    ["route", "method", "status"]
+)
+HTTP_REQUEST_LATENCY = Histogram(
+    "stegapp_http_request_seconds",
+    "REST request latency",
+    ["route", "method"]
+)
+MONGO_COMMANDS = Counter(
+    "stegapp_mongo_commands_total",
+    "MongoDB commands issued, by command name and outcome",
+    ["command", "outcome"]
+)
+MONGO_COMMAND_LATENCY = Histogram(
+    "stegapp_mongo_command_seconds",
+    "MongoDB command round-trip time",
+    ["command"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+UPLOAD_BYTES = Counter(
+    "stegapp_upload_bytes_total",
+    "Bytes received on /upload/, by whether the image was deduplicated",
+    ["deduplicated"]
+)
+UPLOAD_LATENCY = Histogram(
+    "stegapp_upload_seconds",
+    "Time to hash and store an uploaded image",
+    ["deduplicated"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+)
+CONNECTED_SOCKETS = Gauge(
+    "stegapp_connected_sockets",
+    "Currently connected Socket.IO clients"
+)
+EVENT_LOOP_LAG = Histogram(
+    "stegapp_event_loop_lag_seconds",
+    "How late the event loop wakes up a sleeping task",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+WRITE_QUEUE_DEPTH = Gauge(
+    "stegapp_write_queue_depth",
+    "Database writes waiting in the write-behind queue"
+)
+WRITE_BATCH_SIZE = Histogram(
+    "stegapp_write_batch_size",
+    "Operations per write-behind bulk_write",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+)
+WRITE_FAILURES = Counter(
+    "stegapp_write_failures_total",
+    "Write-behind operations whose bulk_write failed"
+)
+WRITE_RETRIES = Counter(
+    "stegapp_write_retries_total",
+    "Write-behind batches retried after a failed bulk_write"
+)
+WRITE_DEAD_LETTERS = Counter(
+    "stegapp_write_dead_letters_total",
+    "Write-behind operations given up on and written to the dead-letter file"
+)
+RETENTION_ARCHIVED = Counter(
+    "stegapp_retention_archived_total",
+    "Delivered-and-read messages moved from the hot collection to the archive"
+)
+RETENTION_RECLAIMED_BYTES = Counter(
+    "stegapp_retention_reclaimed_bytes_total",
+    "BSON bytes removed from the hot messages collection by compaction"
+)
+OFFLINE_QUEUE_DEPTH = Gauge(
+    "stegapp_offline_queue_depth",
+    "Messages stored but not yet delivered to their recipient"
+)
+THROTTLED_EVENTS = Counter(
+    "stegapp_throttled_events_total",
+    "Inbound Socket.IO events rejected by per-connection rate limits",
+    ["event"]
+)
+OUTBOUND_PENDING = Gauge(
+    "stegapp_outbound_pending",
+    "Events waiting in per-connection outbound queues for slow consumers"
+)
+OUTBOUND_COALESCED = Counter(
+    "stegapp_outbound_coalesced_total",
+    "Outbound status events merged into one already queued for a slow consumer",
+    ["event"]
+)
+OUTBOUND_DROPPED = Counter(
+    "stegapp_outbound_dropped_total",
+    "Outbound status events dropped because a slow consumer's queue was full",
+    ["event"]
+)
+SLOW_CONSUMER_DISCONNECTS = Counter(
+    "stegapp_slow_consumer_disconnects_total",
+    "Connections dropped because their outbound queue overflowed with messages"
+)
+
+
+def instrument_event(handler):
+    """
+    Count and time a Socket.IO event handler.
+    Apply below @sio.event so the handler keeps its name.
+    """
+    event = handler.__name__
+    signature = inspect.signature(handler)
+    latency = SOCKET_EVENT_LATENCY.labels(event)
+
+    @functools.wraps(handler)
+    async def wrapper(*args):
+        # python-socketio probes connect/disconnect with several signatures and
+        # retries on TypeError; reject mismatches before recording anything.
+        signature.bind(*args)
+        start = time.perf_counter()
+        outcome = "ok"
+        try:
+            return await handler(*args)
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            latency.observe(time.perf_counter() - start)
+            SOCKET_EVENTS.labels(event, outcome).inc()
+
+    return wrapper
+
+
+async def http_metrics_middleware(request, call_next):
+    """
+    Record REST latency per route template (not raw path, to keep label
+    cardinality bounded when paths embed usernames).
+    """
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        route_path = getattr(route, "path", None) or "unmatched"
+        HTTP_REQUEST_LATENCY.labels(route_path, request.method).observe(time.perf_counter() - start)
+        HTTP_REQUESTS.labels(route_path, request.method, str(status)).inc()
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    pymongo command listener that records per-command timings.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_COMMAND_LATENCY.labels(event.command_name).observe(event.duration_micros / 1e6)
+        MONGO_COMMANDS.labels(event.command_name, "ok").inc()
+
+    def failed(self, event):
+        MONGO_COMMAND_LATENCY.labels(event.command_name).observe(event.duration_micros / 1e6)
+        MONGO_COMMANDS.labels(event.command_name, "error").inc()
+
+
+async def monitor_event_loop_lag(interval=0.5):
+    """
+    Background task: sample event-loop lag until cancelled.
+    """
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, time.perf_counter() - start - interval))
+
+
+def render_metrics():
+    """
+    Returns (body, content_type) in the Prometheus text exposition format.
+    """
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+
+import bson
+from pymongo import UpdateMany
+from pymongo.errors import BulkWriteError, OperationFailure
+
+from metrics import RETENTION_ARCHIVED, RETENTION_RECLAIMED_BYTES
+
+logger = logging.getLogger("stegapp.retention")
+
+# Retention modes for delivered-and-read messages in the hot collection:
+#   "off"     - keep everything (default)
+#   "ttl"     - a TTL index on read_at deletes them after the retention period
+#   "archive" - a background job moves them to a compact archive collection
+# Undelivered messages are never touched: they stay until delivered.
+RETENTION_MODES = ("off", "ttl", "archive")
+TTL_INDEX_NAME = "read_at_ttl"
+ARCHIVE_INDEX_NAME = "read_at_archive"
+READ_AT_BACKFILL = "read_at_backfill"
+
+# Fields kept as queryable top-level keys in the archive; everything else is
+# packed into one zlib-compressed BSON blob.
+ARCHIVE_KEYS = ("recipient", "sender", "seq", "timestamp", "read_at")
+DROPPED_KEYS = ("_id", "delivered", "read")
+
+
+def ensure_ttl_index(collection, retention_seconds):
+    """
+    Create (or retune) the TTL index that expires read messages.
+    """
+    try:
+        collection.create_index(
+            "read_at",
+            name=TTL_INDEX_NAME,
+            expireAfterSeconds=retention_seconds,
+            partialFilterExpression={"delivered": True}
+        )
+    except OperationFailure:
+        # Index exists with another expiry: change it in place
+        collection.database.command(
+            "collMod", collection.name,
+            index={"name": TTL_INDEX_NAME, "expireAfterSeconds": retention_seconds}
+        )
+
+
+def drop_ttl_index(collection):
+    if TTL_INDEX_NAME in collection.index_information():
+        collection.drop_index(TTL_INDEX_NAME)
+
+
+def ensure_archive_index(collection):
+    """
+    Partial index over archivable messages, so each compaction batch is an
+    index range scan rather than a scan of the whole hot collection.
+    """
+    collection.create_index(
+        "read_at",
+        name=ARCHIVE_INDEX_NAME,
+        partialFilterExpression={"delivered": True, "read": True}
+    )
+
+
+def drop_archive_index(collection):
+    if ARCHIVE_INDEX_NAME in collection.index_information():
+        collection.drop_index(ARCHIVE_INDEX_NAME)
+
+
+def backfill_read_at(collection, migrations, batch_size=1000):
+    """
+    One-off migration: messages marked read before read_at existed get it
+    from their send timestamp (or the current time if they have none), so
+    TTL expiry and compaction reach them. Recorded in `migrations` so later
+    startups skip the scan. Blocking. Returns the number of messages updated.
+    """
+    if migrations.find_one({"_id": READ_AT_BACKFILL}):
+        return 0
+
+    updated = 0
+    query = {"read": True, "read_at": {"$exists": False}}
+    while True:
+        batch = list(collection.find(query, {"_id": 1, "timestamp": 1}).limit(batch_size))
+        if not batch:
+            break
+        now = datetime.now(timezone.utc)
+        ops = []
+        for doc in batch:
+            try:
+                read_at = datetime.fromtimestamp(doc["timestamp"] / 1000, tz=timezone.utc)
+            except (KeyError, TypeError, ValueError, OverflowError, OSError):
+                read_at = now
+            ops.append(UpdateMany({"_id": doc["_id"]}, {"$set": {"read_at": read_at}}))
+        collection.bulk_write(ops, ordered=False)
+        updated += len(ops)
+
+    migrations.update_one(
+        {"_id": READ_AT_BACKFILL},
+        {"$set": {"done_at": datetime.now(timezone.utc), "updated": updated}},
+        upsert=True
+    )
+    return updated
+
+
+def to_archive(doc):
+    archived = {key: doc.get(key) for key in ARCHIVE_KEYS}
+    archived["_id"] = doc["_id"]
+    rest = {k: v for k, v in doc.items() if k not in ARCHIVE_KEYS and k not in DROPPED_KEYS}
+    archived["body"] = bson.Binary(zlib.compress(bson.encode(rest)))
+    return archived
+
+
+def from_archive(archived):
+    """
+    Inverse of to_archive(), for tools that need to read archived messages.
+    """
+    doc = bson.decode(zlib.decompress(archived["body"]))
+    doc.update({key: archived.get(key) for key in ARCHIVE_KEYS})
+    doc.update({"_id": archived["_id"], "delivered": True, "read": True})
+    return doc
+
+
+def compact_messages(hot, archive, cutoff, batch_size=1000):
+    """
+    Move delivered-and-read messages read before `cutoff` from the hot
+    collection to the archive, in batches. Blocking; run it off the event loop.
+    Returns a report dict.
+    """
+    started = time.perf_counter()
+    moved = 0
+    hot_bytes = 0
+    archive_bytes = 0
+    query = {"delivered": True, "read": True, "read_at": {"$lt": cutoff}}
+
+    while True:
+        batch = list(hot.find(query).limit(batch_size))
+        if not batch:
+            break
+
+        archived = [to_archive(doc) for doc in batch]
+        try:
+            archive.insert_many(archived, ordered=False)
+        except BulkWriteError as e:
+            # Duplicates are left over from an interrupted run and are safe to skip
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+        hot.delete_many({"_id": {"$in": [doc["_id"] for doc in batch]}})
+
+        moved += len(batch)
+        hot_bytes += sum(len(bson.encode(doc)) for doc in batch)
+        archive_bytes += sum(len(bson.encode(doc)) for doc in archived)
+
+    return {
+        "archived": moved,
+        "reclaimed_bytes": hot_bytes,
+        "archive_bytes": archive_bytes,
+        "seconds": round(time.perf_counter() - started, 3)
+    }
+
+
+async def run_compaction(hot, archive, retention_seconds, interval_seconds, batch_size=1000):
+    """
+    Background task: periodically archive expired messages and report
+    how much hot-collection space each run reclaimed.
+    """
+    while True:
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=retention_seconds)
+        try:
+            report = await asyncio.to_thread(compact_messages, hot, archive, cutoff, batch_size)
+            RETENTION_ARCHIVED.inc(report["archived"])
+            RETENTION_RECLAIMED_BYTES.inc(report["reclaimed_bytes"])
+            if report["archived"]:
+                logger.info(
+                    "Compaction archived %d messages, reclaimed %d bytes from hot collection (%d bytes in archive) in %.2fs",
+                    report["archived"], report["reclaimed_bytes"], report["archive_bytes"], report["seconds"]
+                )
+        except Exception as e:
+            logger.exception("Compaction failed: %s", e)
+        await asyncio.sleep(interval_seconds)
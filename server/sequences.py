@@ -0,0 +1,40 @@
+import asyncio
+
+from pymongo import ReturnDocument
+
+
+class SequenceAllocator:
+    """
+    Per-key monotonic sequence numbers backed by an atomic Mongo counter.
+    Numbers are reserved in blocks ($inc by block_size), so only one in
+    every block_size calls touches the database. Unused numbers of a block
+    are skipped after a restart: sequences are strictly increasing, not
+    gap-free.
+    """
+
+    def __init__(self, collection, block_size=100):
+        self.collection = collection
+        self.block_size = block_size
+        self.blocks = {}  # key -> [next, last] of the reserved block
+        self._lock = asyncio.Lock()
+
+    async def next(self, key):
+        block = self.blocks.get(key)
+        if block is None or block[0] > block[1]:
+            async with self._lock:
+                block = self.blocks.get(key)
+                if block is None or block[0] > block[1]:
+                    counter = await asyncio.to_thread(
+                        self.collection.find_one_and_update,
+                        {"_id": key},
+                        {"$inc": {"seq": self.block_size}},
+                        upsert=True,
+                        return_document=ReturnDocument.AFTER
+                    )
+                    last = counter["seq"]
+                    block = [last - self.block_size + 1, last]
+                    self.blocks[key] = block
+
+        seq = block[0]
+        block[0] += 1
+        return seq
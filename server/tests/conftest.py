@@ -0,0 +1,24 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Server modules import each other as top-level modules (`from metrics import ...`)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Importing main connects to Mongo and picks a storage backend at import time
+os.environ.setdefault("MONGODB_URI", "mongomock://")
+os.environ.setdefault("STORAGE_BACKEND", "local")
+os.environ.setdefault("UPLOAD_DIR", tempfile.mkdtemp(prefix="stegapp-test-uploads-"))
+
+
+@pytest.fixture
+def database():
+    """
+    Fresh mongomock database for main (normally set up by the app lifespan).
+    """
+    import main
+    main.init_database(main.create_mongo_client())
+    main.public_key_cache.clear()
+    return main
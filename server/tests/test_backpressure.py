@@ -0,0 +1,125 @@
+import asyncio
+
+import msgpack
+
+from backpressure import RateLimiter, OutboundQueues, parse_limit
+from codec import accepts_msgpack
+
+
+def test_parse_limit():
+    assert parse_limit("20/40") == (20.0, 40.0)
+    assert parse_limit("5") == (5.0, 5.0)
+    assert parse_limit("off") == (0.0, 0.0)
+
+
+def test_rate_limiter_burst_and_retry_after():
+    limiter = RateLimiter({"send_message": (1.0, 3.0), "off": (0.0, 0.0)})
+    assert [limiter.allow("a", "send_message") for _ in range(4)] == [True, True, True, False]
+    assert 0 < limiter.retry_after("a", "send_message") <= 1.0
+    # Buckets are per connection, and unlimited events always pass
+    assert limiter.allow("b", "send_message")
+    assert all(limiter.allow("a", "off") for _ in range(100))
+    limiter.discard("a")
+    assert limiter.allow("a", "send_message")
+
+
+def test_limit_rejects_with_retry_after():
+    limiter = RateLimiter({"ping": (1.0, 1.0)})
+
+    @limiter.limit
+    async def ping(sid, data):
+        return "pong"
+
+    async def run():
+        return [await ping("a", {}), await ping("a", {})]
+
+    first, second = asyncio.run(run())
+    assert first == "pong"
+    assert second["error"] == "rate_limited" and second["retryAfter"] > 0
+
+
+def test_limit_overflow_gets_decoded_msgpack():
+    limiter = RateLimiter({"message_read": (1.0, 1.0)})
+    overflowed = []
+
+    async def overflow(sid, data):
+        overflowed.append(data)
+
+    @accepts_msgpack
+    @limiter.limit(overflow=overflow)
+    async def message_read(sid, data):
+        return data["messageId"]
+
+    async def run():
+        return [await message_read("a", msgpack.packb({"messageId": m})) for m in ("m1", "m2")]
+
+    assert asyncio.run(run()) == ["m1", None]
+    assert overflowed == [{"messageId": "m2"}]
+
+
+class FakeTransport:
+    def __init__(self):
+        self.sent = []
+        self.backlog = 0
+        self.disconnected = []
+
+    async def send(self, sid, event, data):
+        self.sent.append((event, data))
+
+    async def disconnect(self, sid):
+        self.disconnected.append(sid)
+
+    def queues(self, **kwargs):
+        return OutboundQueues(self.send, lambda sid: self.backlog, self.disconnect, drain_interval=0.001, **kwargs)
+
+
+def test_outbound_sends_directly_when_keeping_up():
+    transport = FakeTransport()
+    queues = transport.queues()
+    asyncio.run(queues.put("a", "new_message", {"id": "m1"}))
+    assert transport.sent == [("new_message", {"id": "m1"})]
+    assert len(queues) == 0
+
+
+def test_outbound_coalesces_status_while_slow():
+    transport = FakeTransport()
+    transport.backlog = 100
+
+    async def run():
+        queues = transport.queues(high_water=10)
+        await queues.put("a", "message_status", {"messageId": "m1", "status": "delivered"})
+        await queues.put("a", "message_status", {"messageId": "m1", "status": "read"})
+        # A late 'delivered' (e.g. from a sync) must not undo 'read'
+        await queues.put("a", "message_status", {"messageId": "m1", "status": "delivered"})
+        await queues.put("a", "message_status_batch", {"messageIds": ["m2"], "status": "read"})
+        await queues.put("a", "message_status_batch", {"messageIds": ["m3"], "status": "read"})
+        await queues.put("a", "user_status", {"username": "bob", "status": "online"})
+        await queues.put("a", "user_status", {"username": "bob", "status": "offline"})
+        assert len(queues) == 3
+        transport.backlog = 0
+        await asyncio.wait_for(queues.tasks["a"], 1)
+
+    asyncio.run(run())
+    assert transport.sent == [
+        ("message_status", {"messageId": "m1", "status": "read"}),
+        ("message_status_batch", {"messageIds": ["m2", "m3"], "status": "read"}),
+        ("user_status", {"username": "bob", "status": "offline"}),
+    ]
+
+
+def test_outbound_overflow_drops_status_and_disconnects_on_messages():
+    transport = FakeTransport()
+    transport.backlog = 100
+
+    async def run():
+        queues = transport.queues(high_water=10, max_pending=2)
+        await queues.put("a", "new_message", {"id": "m1"})
+        await queues.put("a", "new_message", {"id": "m2"})
+        await queues.put("a", "message_status", {"messageId": "m1", "status": "read"})
+        assert len(queues) == 2 and not transport.disconnected
+        await queues.put("a", "new_message", {"id": "m3"})
+        assert transport.disconnected == ["a"]
+        assert len(queues) == 0
+
+    asyncio.run(run())
+    assert transport.sent == []
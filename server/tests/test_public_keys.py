@@ -0,0 +1,36 @@
+import asyncio
+
+
+def add_user(main, username, public_key):
+    main.users_collection.insert_one({"username": username, "public_key": public_key})
+
+
+def test_keys_are_cached_and_invalidated(database):
+    main = database
+    add_user(main, "alice", "key-a")
+    add_user(main, "bob", None)
+
+    found = asyncio.run(main.get_public_keys(["alice", "bob", "carol"]))
+    assert found == {"alice": "key-a", "bob": None}
+    assert dict(main.public_key_cache) == {"alice": "key-a", "bob": None}
+
+    main.users_collection.update_one({"username": "alice"}, {"$set": {"public_key": "key-a2"}})
+    main.invalidate_public_key("alice")
+    assert asyncio.run(main.get_public_keys(["alice"])) == {"alice": "key-a2"}
+
+
+def test_key_uploaded_during_a_lookup_is_not_cached_stale(database, monkeypatch):
+    main = database
+    add_user(main, "alice", "old")
+    real_to_thread = asyncio.to_thread
+
+    async def to_thread(fn, *args):
+        result = await real_to_thread(fn, *args)
+        # /keys/upload lands while the query is in flight
+        main.users_collection.update_one({"username": "alice"}, {"$set": {"public_key": "new"}})
+        main.invalidate_public_key("alice")
+        return result
+
+    monkeypatch.setattr(main.asyncio, "to_thread", to_thread)
+    assert asyncio.run(main.get_public_keys(["alice"])) == {"alice": "old"}
+    assert "alice" not in main.public_key_cache
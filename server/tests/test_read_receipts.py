@@ -0,0 +1,23 @@
+import asyncio
+
+import msgpack
+
+import main
+
+
+def test_throttled_msgpack_read_receipts_are_deferred(database, monkeypatch):
+    # Older apps send one message_read per message; over the limit they are
+    # deferred, including on msgpack connections (payload is raw bytes)
+    monkeypatch.setattr(main, "READ_DEFER_SECONDS", 60)
+    limit = main.event_limits.limits["message_read"]
+    count = int(limit[1]) + 20
+
+    async def run():
+        for i in range(count):
+            await main.message_read("msgpack-sid", msgpack.packb({"messageId": f"m{i}", "reader": "bob"}))
+        return main.deferred_reads.pop("msgpack-sid", [])
+
+    deferred = asyncio.run(run())
+    assert 0 < len(deferred) <= count
+    assert all(m.startswith("m") for m in deferred)
+    main.event_limits.discard("msgpack-sid")
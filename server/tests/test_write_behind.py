@@ -0,0 +1,200 @@
+import asyncio
+import json
+
+import pytest
+from pymongo import InsertOne, UpdateMany
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from write_behind import WriteBehindQueue
+
+
+class StubCollection:
+    """
+    Records bulk_write batches; `failures` is a list of exceptions (or
+    callables taking the batch and returning one) raised by successive calls.
+    """
+    name = "messages"
+
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+        self.written = []
+        self.calls = 0
+
+    def bulk_write(self, batch, ordered=True):
+        self.calls += 1
+        if self.failures:
+            failure = self.failures.pop(0)
+            if callable(failure):
+                failure = failure(batch)
+            if failure is not None:
+                raise failure
+        self.written.extend(batch)
+
+
+def write_error(index, code=121, errmsg="Document failed validation"):
+    return lambda batch: BulkWriteError({
+        "writeErrors": [{"index": index, "code": code, "errmsg": errmsg}],
+        "writeConcernErrors": [],
+        "nInserted": index
+    })
+
+
+def write_concern_error():
+    return BulkWriteError({
+        "writeErrors": [],
+        "writeConcernErrors": [{"code": 64, "errmsg": "waiting for replication timed out"}]
+    })
+
+
+def make_queue(collection, tmp_path, **kwargs):
+    return WriteBehindQueue(collection, retry_base=0.001, retry_max=0.001,
+                            dead_letter_path=str(tmp_path / "dead.jsonl"), **kwargs)
+
+
+def dead_letters(tmp_path):
+    path = tmp_path / "dead.jsonl"
+    return [json.loads(line) for line in path.read_text().splitlines()] if path.exists() else []
+
+
+def test_flush_writes_in_order(tmp_path):
+    collection = StubCollection()
+    queue = make_queue(collection, tmp_path, batch_size=2)
+    ops = [InsertOne({"n": i}) for i in range(5)]
+
+    async def run():
+        for op in ops:
+            await queue.put(op)
+        assert len(queue) == 5
+        await queue.flush()
+
+    asyncio.run(run())
+    assert collection.written == ops
+    assert len(queue) == 0
+
+
+def test_transient_failure_is_retried(tmp_path):
+    collection = StubCollection([AutoReconnect("stepdown"), AutoReconnect("stepdown")])
+    queue = make_queue(collection, tmp_path)
+    ops = [InsertOne({"n": 1}), UpdateMany({"n": 1}, {"$set": {"read": True}})]
+
+    async def run():
+        for op in ops:
+            await queue.put(op)
+        await queue.flush()
+
+    asyncio.run(run())
+    assert collection.calls == 3
+    assert collection.written == ops
+    assert dead_letters(tmp_path) == []
+
+
+def test_write_concern_error_is_retried(tmp_path):
+    collection = StubCollection([write_concern_error()])
+    queue = make_queue(collection, tmp_path)
+    op = InsertOne({"n": 1})
+
+    async def run():
+        await queue.put(op)
+        await queue.flush()
+
+    asyncio.run(run())
+    assert collection.written == [op]
+
+
+def test_rejected_op_is_dead_lettered_and_rest_written(tmp_path):
+    collection = StubCollection([write_error(1)])
+    queue = make_queue(collection, tmp_path)
+    ops = [InsertOne({"n": i}) for i in range(3)]
+
+    async def run():
+        for op in ops:
+            await queue.put(op)
+        await queue.flush()
+
+    asyncio.run(run())
+    # The op before the failure was applied by the failed call
+    assert collection.written == [ops[2]]
+    assert [entry["document"] for entry in dead_letters(tmp_path)] == [{"n": 1}]
+
+
+def test_duplicate_insert_is_skipped(tmp_path):
+    collection = StubCollection([write_error(0, code=11000, errmsg="E11000 duplicate key")])
+    queue = make_queue(collection, tmp_path)
+    ops = [InsertOne({"n": 1}), InsertOne({"n": 2})]
+
+    async def run():
+        for op in ops:
+            await queue.put(op)
+        await queue.flush()
+
+    asyncio.run(run())
+    assert collection.written == [ops[1]]
+    assert dead_letters(tmp_path) == []
+
+
+def test_exhausted_retries_are_dead_lettered(tmp_path):
+    collection = StubCollection([AutoReconnect("down")] * 3)
+    queue = make_queue(collection, tmp_path, max_retries=2)
+
+    async def run():
+        await queue.put(InsertOne({"n": 1}))
+        await queue.flush()
+
+    asyncio.run(run())
+    assert collection.written == []
+    assert [entry["document"] for entry in dead_letters(tmp_path)] == [{"n": 1}]
+
+
+def test_sync_mode_raises_after_retries(tmp_path):
+    collection = StubCollection([AutoReconnect("down")] * 2)
+    queue = make_queue(collection, tmp_path, durability="sync", max_retries=1)
+
+    async def run():
+        await queue.put(InsertOne({"n": 1}))
+
+    with pytest.raises(AutoReconnect):
+        asyncio.run(run())
+
+
+def test_len_counts_the_batch_being_written(tmp_path):
+    collection = StubCollection([AutoReconnect("stepdown")])
+    queue = WriteBehindQueue(collection, retry_base=0.2, dead_letter_path=str(tmp_path / "dead.jsonl"))
+
+    async def run():
+        await queue.put(InsertOne({"n": 1}))
+        flushing = asyncio.create_task(queue.flush())
+        await asyncio.sleep(0.05)
+        # The batch is in retry backoff: off `pending`, but not written yet
+        assert queue.pending == [] and len(queue) == 1
+        await flushing
+        assert len(queue) == 0
+
+    asyncio.run(run())
+    assert len(collection.written) == 1
+
+
+def test_background_flusher_survives_a_failed_flush(tmp_path, monkeypatch):
+    collection = StubCollection()
+    queue = make_queue(collection, tmp_path, flush_interval=0.01)
+    real_write = queue._write
+    calls = []
+
+    async def flaky_write(batch):
+        calls.append(batch)
+        if len(calls) == 1:
+            raise IndexError("list index out of range")
+        await real_write(batch)
+
+    monkeypatch.setattr(queue, "_write", flaky_write)
+
+    async def run():
+        queue.start()
+        await queue.put(InsertOne({"n": 1}))
+        await asyncio.sleep(0.05)
+        assert not queue._task.done()
+        await queue.put(InsertOne({"n": 2}))
+        await asyncio.sleep(0.05)
+        await queue.stop()
+
+    asyncio.run(run())
+    assert [op._doc for op in collection.written] == [{"n": 2}]
@@ -0,0 +1,195 @@
+import asyncio
+import datetime
+import logging
+
+from bson import json_util
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError
+
+from metrics import WRITE_QUEUE_DEPTH, WRITE_BATCH_SIZE, WRITE_FAILURES, WRITE_RETRIES, WRITE_DEAD_LETTERS
+
+logger = logging.getLogger("stegapp.write_behind")
+
+# Durability modes:
+#   "batched" - writes are queued and flushed in micro-batches; the relay
+#               does not wait for Mongo
+#   "sync"    - every write is flushed before put() returns
+DURABILITY_MODES = ("batched", "sync")
+
+# What is guaranteed:
+# - A batch that fails (e.g. during a primary stepdown) stays at the head of
+#   the queue and is retried with exponential backoff, in order. Retried
+#   inserts that hit a duplicate key were applied by an earlier attempt and
+#   are skipped; updates are idempotent $set operations. A batch that was
+#   applied but not acknowledged by the write concern (e.g. a wtimeout) is
+#   retried the same way.
+# - An op the server rejects outright (a write error on that op) and a batch
+#   still failing after max_retries attempts are appended to the dead-letter
+#   file (JSON lines) instead of being dropped silently.
+# - In batched mode, ops still in memory when the process dies are lost.
+
+
+class WriteBehindQueue:
+    """
+    Bounded write-behind queue for one collection.
+    Accepts pymongo write models (InsertOne, UpdateOne, UpdateMany, ...)
+    and applies them in order with bulk_write, off the event loop.
+    """
+
+    def __init__(self, collection, durability="batched", max_pending=10000, batch_size=500, flush_interval=0.05,
+                 max_retries=8, retry_base=0.1, retry_max=5.0, dead_letter_path="write_dead_letter.jsonl"):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode {durability!r}, expected one of {DURABILITY_MODES}")
+        self.collection = collection
+        self.durability = durability
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.dead_letter_path = dead_letter_path
+        self.pending = []
+        self.in_flight = 0  # ops taken off `pending` and still being written
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def __len__(self):
+        # Includes the batch being written (or waiting to retry), so callers
+        # that check len() before flush() also wait for that batch
+        return len(self.pending) + self.in_flight
+
+    async def put(self, op):
+        # Bounded: a full queue makes the producer wait for a flush (backpressure)
+        while len(self.pending) >= self.max_pending:
+            await self.flush()
+        self.pending.append(op)
+        WRITE_QUEUE_DEPTH.set(len(self.pending))
+
+        if self.durability == "sync":
+            await self.flush()
+        elif len(self.pending) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self):
+        """
+        Write everything queued so far. Safe to call concurrently; batches
+        are written one at a time so operation order is preserved.
+        """
+        async with self._lock:
+            while self.pending:
+                batch = self.pending[:self.batch_size]
+                del self.pending[:self.batch_size]
+                WRITE_QUEUE_DEPTH.set(len(self.pending))
+                WRITE_BATCH_SIZE.observe(len(batch))
+                self.in_flight = len(batch)
+                try:
+                    await self._write(batch)
+                finally:
+                    self.in_flight = 0
+
+    async def _write(self, batch):
+        """
+        Write one batch in order, retrying failures with backoff.
+        """
+        attempt = 0
+        while batch:
+            try:
+                await asyncio.to_thread(self.collection.bulk_write, batch, ordered=True)
+                return
+            except BulkWriteError as e:
+                write_errors = e.details.get("writeErrors") or []
+                if write_errors:
+                    # Ordered: everything before the failing op was applied,
+                    # nothing after it was attempted
+                    error = write_errors[0]
+                    index = error["index"]
+                    if not (error.get("code") == 11000 and isinstance(batch[index], InsertOne)):
+                        WRITE_FAILURES.inc()
+                        self._dead_letter([batch[index]], error.get("errmsg"))
+                    batch = batch[index + 1:]
+                    continue
+                # Only write concern errors (e.g. wtimeout): the ops were
+                # applied but not acknowledged; retrying them is safe
+                failure = e
+            except asyncio.CancelledError:
+                # Shutting down mid-retry: keep the batch for the final flush
+                self.pending[:0] = batch
+                WRITE_QUEUE_DEPTH.set(len(self.pending))
+                raise
+            except Exception as e:
+                failure = e
+
+            attempt += 1
+            WRITE_FAILURES.inc(len(batch))
+            if attempt > self.max_retries:
+                self._dead_letter(batch, str(failure))
+                if self.durability == "sync":
+                    raise failure
+                return
+            delay = min(self.retry_base * 2 ** (attempt - 1), self.retry_max)
+            WRITE_RETRIES.inc()
+            logger.warning("Write-behind flush of %d ops failed (attempt %d/%d), retrying in %.1fs: %s",
+                           len(batch), attempt, self.max_retries, delay, failure)
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                self.pending[:0] = batch
+                WRITE_QUEUE_DEPTH.set(len(self.pending))
+                raise
+
+    def _dead_letter(self, ops, reason):
+        """
+        Append ops that could not be written to the dead-letter file, one
+        JSON document per line, so they can be inspected and replayed.
+        """
+        WRITE_DEAD_LETTERS.inc(len(ops))
+        logger.error("Dead-lettering %d write-behind ops to %s: %s", len(ops), self.dead_letter_path, reason)
+        failed_at = datetime.datetime.now(datetime.timezone.utc)
+        try:
+            with open(self.dead_letter_path, "a", encoding="utf-8") as out:
+                for op in ops:
+                    # pymongo write models keep their arguments in private slots
+                    entry = {
+                        "failed_at": failed_at,
+                        "reason": reason,
+                        "collection": self.collection.name,
+                        "op": type(op).__name__,
+                        "filter": getattr(op, "_filter", None),
+                        "document": op._doc
+                    }
+                    out.write(json_util.dumps(entry) + "\n")
+        except OSError as e:
+            logger.exception("Could not write dead-letter file: %s", e)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self.pending:
+                try:
+                    await self.flush()
+                except Exception as e:
+                    # One bad flush must not stop write-behind for the process
+                    logger.exception("Write-behind flush failed: %s", e)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop the background flusher and write whatever is still queued.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()